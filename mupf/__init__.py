@@ -24,6 +24,7 @@ else:
 from . import log
 
 from ._app import App
+from ._srvthr import OutqueuePolicy
 from . import _symbols as S
 from . import _features as F
 from . import client    # This and following ones just to be explicit
@@ -13,13 +13,14 @@ from http import HTTPStatus
 import pkg_resources
 import websockets
 
+from . import _command
 from . import _features as F
 from . import client, exceptions
 from ._macro import MacroByteStream
 from . import log
 from .log import loggable, loggable_class
 
-from ._srvthr import App_SrvThrItf
+from ._srvthr import App_SrvThrItf, OutqueuePolicy
 
 
 @loggable(
@@ -46,11 +47,64 @@ class App(App_SrvThrItf):
         port: int = default_port,
         charset: str ='utf-8',
         features: T.Iterable[F._features__Feature]= (),
+        fragment_size: int = 256*1024,
+        chunk_size: T.Optional[int] = 256*1024,
+        bundle: bool = True,
+        flush_delay: float = 0.0,
+        outqueue_limit: T.Optional[int] = None,
+        outqueue_policy: OutqueuePolicy = OutqueuePolicy.block,
+        parse_once: bool = False,
+        command_timeout: T.Optional[float] = None,
+        max_size: T.Optional[int] = 2**20,
+        max_queue: T.Optional[int] = 32,
+        read_limit: int = 2**16,
+        write_limit: int = 2**16,
+        compression: bool = True,
+        compression_level: int = -1,
+        compression_threshold: int = 0,
+        compression_window_bits: T.Optional[int] = None,
+        loop_threads: int = 1,
     ):
         self._t0: float = time.time()
         self._host: str = host
         self._port: int = port
         self._charset: str = charset
+        # Outgoing messages longer than this (in characters) are sent as fragmented websocket messages, if they are not
+        # chunked
+        self._fragment_size: int = fragment_size
+        # Outgoing messages longer than this are sent in chunks interleaved with other messages (see `docs/crrcan.md`),
+        # so a long message does not hold back the short ones. With `None` they are sent as fragmented messages.
+        self._chunk_size: T.Optional[int] = chunk_size
+        # Messages waiting together on the outgoing queue are sent as one bundle message (see `docs/crrcan.md`), the
+        # queue is drained `flush_delay` seconds after the first message arrives
+        self._bundle: bool = bundle
+        self._flush_delay: float = flush_delay
+        # At most `outqueue_limit` messages wait for sending in a client (`None` is no limit), see `OutqueuePolicy`
+        self._outqueue_limit: T.Optional[int] = outqueue_limit
+        self._outqueue_policy: OutqueuePolicy = outqueue_policy
+        # Incoming messages are decoded in the server thread, the main thread only dispatches them
+        self._parse_once: bool = parse_once
+        # The initial `Client.command_timeout` of the clients
+        self._command_timeout: T.Optional[float] = command_timeout
+        # Options of the websocket connections. Incoming messages longer than `max_size` bytes close the connection,
+        # at most `max_queue` incoming messages are buffered (`None` is no limit in both), and the `read_limit` and
+        # `write_limit` are the high-water marks (in bytes) of the buffers of the transport.
+        self._max_size: T.Optional[int] = max_size
+        self._max_queue: T.Optional[int] = max_queue
+        self._read_limit: int = read_limit
+        self._write_limit: int = write_limit
+        # The permessage-deflate compression, if the browser agrees, with a zlib `compression_level` (`-1` is the zlib
+        # default, `0` is no compression) and window size (8 to 15 bits, `None` for the maximum). Messages shorter than
+        # `compression_threshold` bytes are sent uncompressed.
+        self._compression: bool = compression
+        self._compression_level: int = compression_level
+        self._compression_threshold: int = compression_threshold
+        self._compression_window_bits: T.Optional[int] = compression_window_bits
+        # The number of server threads, each one with its own event loop. The loop `k` serves the port `port + k`, and
+        # each client is served by one of them, the least busy one at summon time (see `Client.url`).
+        if loop_threads < 1:
+            raise ValueError("`loop_threads` argument of `App` must be at least 1")
+        self._loop_threads: int = loop_threads
         self._features: set[F._features__Feature] = set()
 
         # Checking the format of `features` argument.  Tested in `vanilla_env/test_featyres.py/Features`
@@ -107,6 +161,21 @@ class App(App_SrvThrItf):
         client.summoned()
         return client
 
+    @loggable()
+    def broadcast(self, cmd_name: str, *args, **kwargs) -> _command.CommandBroadcast:
+        """ Issue the command `cmd_name` in all connected clients
+
+        The payload is encoded once and shared by the messages of all clients (see `CommandBroadcast`). The results are
+        collected in the returned `CommandBroadcast`, which can be also awaited.
+        """
+        return _command.CommandBroadcast(list(self._clients_by_cid.values()), cmd_name, False, args, kwargs)
+
+    @loggable()
+    def broadcast_run(self, cmd_name: str, *args, **kwargs) -> _command.CommandBroadcast:
+        """ Issue the command `cmd_name` in all connected clients as a notification, see `broadcast()`
+        """
+        return _command.CommandBroadcast(list(self._clients_by_cid.values()), cmd_name, True, args, kwargs)
+
     @loggable()
     def __enter__(self):
         if not self.is_closed():
@@ -125,13 +194,25 @@ class App(App_SrvThrItf):
 
     @loggable()
     def open(self):
-        self._server_thread = threading.Thread(
-            target = self._server_thread_body,
-            daemon = False,
-            name = f"mupfapp-{self._host}:{self._port}"
-        )
-        self._server_thread.start()
-        self._server_opened_mutex.wait()
+        self._event_loops = [None] * self._loop_threads
+        self._server_opened_mutexes = [threading.Event() for _ in range(self._loop_threads)]
+        self._server_closed_mutexes = [threading.Event() for _ in range(self._loop_threads)]
+        self._server_threads = [
+            threading.Thread(
+                target = self._server_thread_body,
+                args = (index,),
+                daemon = False,
+                name = f"mupfapp-{self._host}:{self._port + index}"
+            )
+            for index in range(self._loop_threads)
+        ]
+        for thread in self._server_threads:
+            thread.start()
+        for mutex in self._server_opened_mutexes:
+            mutex.wait()
+        if self.is_closed():
+            # Some server thread failed to open, the others are not left running
+            self._stop_event_loops(wait=True)
         return self
 
     @loggable(log_results=False)
@@ -147,22 +228,27 @@ class App(App_SrvThrItf):
         It returns `False` if it is not closed. Otherwise it returns `True` by default or an exception if asked for the
         culprit of the app being closed. The exception is not rised - it is only returned and must be rised outside.
         """
+        # The app is closed if any of its event loops is (or was never opened)
+        event_loops = self._event_loops or [self._event_loop]
         if get_culprit:
             if not self.is_closed():
                 return False
-            elif isinstance(self._event_loop, asyncio.events.AbstractEventLoop):
+            # An exception of a failed loop is the most telling, the other loops may be already closed because of it
+            failed = [evl for evl in event_loops if not isinstance(evl, asyncio.events.AbstractEventLoop)]
+            event_loop = failed[0] if failed else next(evl for evl in event_loops if evl.is_closed())
+            if isinstance(event_loop, asyncio.events.AbstractEventLoop):
                 return RuntimeError(f'Event loop in `{self}` was closed')
-            elif self._event_loop is None:
+            elif event_loop is None:
                 # It's hard to give a reason, because this should never happen (FLW) unless user creates App, does not
                 # open it and asks why it is closed.
                 return RuntimeError(f'Event loop in `{self}` was never created (`App` was never opened?)')
             else:
-                return self._event_loop # if event-loop is not opened this is an exception
+                return event_loop # if event-loop is not opened this is an exception
         else:
-            if isinstance(self._event_loop, asyncio.events.AbstractEventLoop):
-                return self._event_loop.is_closed()
-            else:
-                return True
+            return not all(
+                isinstance(evl, asyncio.events.AbstractEventLoop) and not evl.is_closed()
+                for evl in event_loops
+            )
 
     @loggable()
     def _get_client_by_cid(self, cid):
@@ -173,9 +259,16 @@ class App(App_SrvThrItf):
         for cl in self._clients_by_cid.values():
             cl.close(_dont_remove_from_app=True)
         self._clients_by_cid.clear()
-        self._event_loop.call_soon_threadsafe(self._event_loop.stop)
+        self._stop_event_loops(wait)
+
+    def _stop_event_loops(self, wait):
+        for event_loop in self._event_loops:
+            if isinstance(event_loop, asyncio.events.AbstractEventLoop):
+                event_loop.call_soon_threadsafe(event_loop.stop)
         if wait:
-            self._server_closed_mutex.wait()
+            for event_loop, mutex in zip(self._event_loops, self._server_closed_mutexes):
+                if isinstance(event_loop, asyncio.events.AbstractEventLoop):
+                    mutex.wait()
 
 #region It's a mess
 
@@ -265,7 +358,12 @@ class App(App_SrvThrItf):
 
     @loggable()
     def piggyback_call(self, function, *args):
-        self._event_loop.call_soon_threadsafe(function, *args)
+        """ Call `function(*args)` in the server thread
+
+        It is the thread of the event loop serving the first client among the `args`, or the main one.
+        """
+        event_loop = next((arg._get_eventloop() for arg in args if isinstance(arg, client.Client)), self._event_loop)
+        event_loop.call_soon_threadsafe(function, *args)
 
     def __repr__(self):
         return f"<App {id(self):X}>"
@@ -1,9 +1,12 @@
+import asyncio
 import weakref
 import threading
 import time
 from ._remote import RemoteObj
 from .log import loggable
 
+from . import _srvthr
+from . import exceptions
 from._srvthr import MetaCommand_SrvThrItf
 
 class MetaCommand(type, MetaCommand_SrvThrItf):
@@ -30,6 +33,8 @@ class MetaCommand(type, MetaCommand_SrvThrItf):
         type.__init__(cls, name, bases, dict_)
         cls._last_ccid = None
         cls._legal_names = ['*first*', '*last*', '*install*', '*features*']
+        cls._batch_local = _BatchLocal()
+        cls._default_timeout = None
         MetaCommand_SrvThrItf.__init__(cls)
 
 
@@ -39,8 +44,140 @@ class MetaCommand(type, MetaCommand_SrvThrItf):
             # which may be a little too complicated for such a low-level stuff as naming commands. After all, this is
             # the main purpose of the "mupf" name - to name reserved things internally.
             raise RuntimeError('Command names cannot end with `mupf`')
+        if (name.startswith('__') and name.endswith('__')) or name.startswith('_asyncio_'):
+            # Probes of Python protocols (e.g. `asyncio.isfuture()`) must not see a command. Such a command can be
+            # still issued with `cls(name)` syntax.
+            raise AttributeError(name)
         return cls(name)    #pylint: disable=no-value-for-parameter
 
+    def batch(cls):
+        """ A context manager sending all commands issued in its `with` block as one group
+
+        See `CommandBatch`. A JS-side command named "batch" can still be issued as `client.command('batch')`.
+        """
+        return CommandBatch(cls)
+
+
+class _BatchLocal(threading.local):
+    batch = None
+    """ The `CommandBatch` active in the thread """
+
+
+class CommandBatch:
+    """
+    Commands issued in the `with` block (in the same thread) are sent together, as one CRRCAN group message, when the
+    block is exited. The JS-side sends all their responses together, in one bundle message, so the results of all
+    commands are known after a single round trip.
+
+    The calls of a batch are normal `CommandCall` objects, each one is resolved separately (an error in one command does
+    not affect others). However, their results cannot be read inside the `with` block, because they are not sent yet --
+    this includes attributes of `RemoteObj`. The arguments of the commands are encoded when the block is exited, so they
+    should not be changed inside of the block. Nested batches are sent with the outermost one.
+    """
+
+    def __init__(self, command_class):
+        self._command_class = command_class
+        self._outer = None
+        self._messages = []
+        self.commands = []
+        """ The calls (`CommandCall`) issued in the batch, in order """
+
+    def __enter__(self):
+        local = self._command_class._batch_local
+        self._outer = local.batch
+        local.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # The commands are sent even if the block ends with an exception, because they are already waiting for the
+        # responses
+        self._command_class._batch_local.batch = self._outer
+        if self._outer is not None:
+            self._outer._messages.extend(self._messages)
+            self._outer.commands.extend(self.commands)
+        elif self._messages:
+            self._command_class._client_wr()._send(
+                [_srvthr._CrrcanMode.grp, -1, len(self._messages), self._messages]
+            )
+        self._messages = []
+
+    def _append(self, call, message):
+        self.commands.append(call)
+        self._messages.append(message)
+
+    @property
+    def results(self):
+        """ The results of all commands of the batch, in order
+
+        The exception is put in place of the result of a failed command.
+        """
+        results = []
+        for cmd in self.commands:
+            try:
+                results.append(cmd.result)
+            except Exception as exc:
+                results.append(exc)
+        return results
+
+
+class CommandBroadcast:
+    """
+    The same command issued in many clients at once, see `App.broadcast()`.
+
+    The payload of the command is encoded once for all clients with the same features, and only the control values
+    (mode, ccid, noun) are written for each client. If the payload holds values encoded differently in each client
+    (callbacks, `RemoteObj`), it is encoded for each client separately. The broadcast commands are never a part of a
+    `CommandBatch`.
+
+    The object is awaitable, the value of `await` are the `results`.
+    """
+
+    def __init__(self, clients, cmd_name, notification, args, kwargs):
+        self.calls = {}
+        """ The calls (`CommandCall`) of the command by the client ids """
+        mode = _srvthr._CrrcanMode.run if notification else _srvthr._CrrcanMode.cmd
+        payloads = {}
+        for client in clients:
+            if not client._healthy_connection:
+                continue
+            call = client.command(cmd_name)._new_call(notification)
+            self.calls[client._cid] = call
+            key = client._shared_encoding_key()
+            if key not in payloads:
+                payloads[key] = client._encode_shared_payload({'args': args, 'kwargs': kwargs})
+            if (chunks := payloads[key]) is not None:
+                client._send_shared(mode, call._ccid, cmd_name, chunks)
+            else:
+                client._send(call._jsonify(args, kwargs))
+
+    @property
+    def wait(self):
+        for call in self.calls.values():
+            call.wait
+        return self
+
+    @property
+    def results(self):
+        """ The results of the command by the client ids
+
+        The exception is put in place of the result of a failed command.
+        """
+        results = {}
+        for cid, call in self.calls.items():
+            try:
+                results[cid] = call.result
+            except Exception as exc:
+                results[cid] = exc
+        return results
+
+    def __await__(self):
+        for call in self.calls.values():
+            try:
+                yield from call.__await__()
+            except Exception:
+                pass    # it is put in the `results`
+        return self.results
+
 
 class NoResult:
     pass
@@ -48,8 +185,159 @@ class NoResult:
 class NotificationNullResult:
     pass
 
-class CommandReissueFast(Exception):
-    pass
+def _set_future_done(future):
+    if not future.done():    # The awaiting task may be already cancelled
+        future.set_result(None)
+
+
+class CommandCall:
+    """
+    A single call of a command. Object holds the ccid, the state and the result of the call.
+
+    It is returned by calling a `Command` object. The `result` property holds the result of the call, however if it is
+    attempted to read the `result` when it is not already known, the current thread will be blocked until the result is
+    known (or the coroutine, if the call is awaited). If an error occured during execution, attempt to read the `result`
+    will rise an appropriate exception.
+
+    Each call of a `Command` makes a new `CommandCall`, so the same `Command` can be called from many threads at once.
+
+    A call with a timeout (see `Command.with_timeout()` and `Client.command_timeout`) has a deadline counted from the
+    moment it is issued. If the result is not known by then, waiting for it raises `exceptions.CommandTimeoutError`, the
+    call is resolved with this exception, and the JS-side is told to cancel the command.
+    """
+    __slots__ = (
+        '_command', '_notification', '_ccid', '_deadline', '_is_resolved', '_result', '_raw_result', '_is_error',
+        '_futures',
+    )
+
+    def __init__(self, command, notification):
+        self._command = command
+        self._notification = notification
+        self._ccid = None
+        # `time.monotonic()` after which the result is not waited for anymore, `None` for no timeout
+        self._deadline = None
+        # Set under the `_global_mutex` (and with `_resolved_cond` notified) when the result is known
+        self._is_resolved = False
+        self._result = NoResult
+        self._raw_result = None
+        self._is_error = False
+        # Futures (with their event loops) of the coroutines awaiting the call
+        self._futures = []
+
+    def _jsonify(self, args, kwargs):
+        return [
+            (2 if self._notification else 0),   # Magic numbers: mode
+            self._ccid,
+            self._command._cmd_name,
+            {
+                'args': args,
+                'kwargs': kwargs,
+            },
+        ]
+
+    def _check_not_batched(self):
+        batch = type(self._command)._batch_local.batch
+        if batch is not None and self in batch.commands:
+            raise RuntimeError(f'result of `{self._command._cmd_name}` is not known before its batch is sent')
+
+    @property
+    def wait(self):
+        if not self._is_resolved:
+            self._check_not_batched()
+            cond = type(self._command)._resolved_cond
+            with cond:
+                resolved = cond.wait_for(lambda: self._is_resolved, self._time_left())
+            if not resolved and not self._time_out():
+                # The response came just in time and is being resolved by the server thread
+                with cond:
+                    cond.wait_for(lambda: self._is_resolved)
+        return self
+
+    def _time_left(self):
+        if self._deadline is None:
+            return None
+        return max(self._deadline - time.monotonic(), 0.0)
+
+    def _time_out(self):
+        command_class = type(self._command)
+        exc = exceptions.CommandTimeoutError(
+            f'no response for command `{self._command._cmd_name}` (ccid={self._ccid}) before its deadline'
+        )
+        if not command_class.set_cancelled_mupf(self, exc):
+            return False
+        command_class._client_wr()._send([_srvthr._CrrcanMode.cnl, self._ccid, 0, {}])
+        return True
+
+    @property
+    def result(self):
+        self.wait
+        self._resolve()
+        if self._is_error:
+            raise self._result
+        return self._result
+
+    def __next__(self):
+        if self._is_resolved:
+            self._resolve()
+            if self._is_error:
+                raise self._result
+            raise StopIteration(self._result)
+
+    def _resolve(self, value=NoResult):
+        # Two threads can decode the raw result at the same time, but they get the same value. The `_is_error` is set
+        # first, so it is valid as soon as `_result` is.
+        if self._result is not NoResult:
+            return
+        if value is NoResult:
+            mode, ccid, noun, pyld = type(self._command)._client_wr()._decode_crrcan_msg(self._raw_result)
+            value = pyld['result']
+        self._is_error = isinstance(value, Exception)
+        self._result = value
+
+    def is_in_bad_state(self):
+        if not self._is_resolved:
+            return True
+        if self._is_error:
+            return self._result
+        return False
+
+    def __await__(self):
+        """ Interface for `await command(...)` syntax
+
+        The awaiting coroutine is resumed (in its own event loop) when the call is resolved, no thread is blocked in the
+        meantime. The value of `await` is the `result`.
+        """
+        if not self._is_resolved:
+            self._check_not_batched()
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            with type(self._command)._global_mutex:
+                # The call is resolved under the `_global_mutex`, so the future cannot be missed
+                if self._is_resolved:
+                    future.set_result(None)
+                else:
+                    self._futures.append((loop, future))
+            if self._deadline is None:
+                yield from future
+            else:
+                try:
+                    yield from asyncio.wait_for(future, self._time_left()).__await__()
+                except asyncio.TimeoutError:
+                    self._time_out()
+        return self.result
+
+    def _notify_awaiting(self):
+        with type(self._command)._global_mutex:
+            futures, self._futures = self._futures, []
+        for loop, future in futures:
+            loop.call_soon_threadsafe(_set_future_done, future)
+
+    def __iter__(self):
+        return self
+
+    def __repr__(self):
+        return f"<CommandCall {('run' if self._notification else 'cmd')} {self._ccid} {self._command._cmd_name}>"
+
 
 @loggable('command.py/*')
 def create_command_class_for_client(client):
@@ -60,10 +348,10 @@ def create_command_class_for_client(client):
     @loggable(
         f'command.py/*<{client._cid[0:6]}><obj>',
         log_path = False,
-        short = lambda self: f"<{getattr(self, '_ccid', '?')}-{id(self):X}>",
-        long = lambda self: f"<Command {('run' if getattr(self, '_notification', False) else 'cmd')} {getattr(self, '_ccid', '?')} {getattr(self, '_cmd_name', '?')} {id(self):X}>",
-        short_det = lambda self: f"<{getattr(self, '_ccid', '?')}>",
-        long_det = lambda self: f"<Command {('run' if getattr(self, '_notification', False) else 'cmd')} {getattr(self, '_ccid', '?')} {getattr(self, '_cmd_name', '?')}>",
+        short = lambda self: f"<{getattr(self, '_cmd_name', '?')}-{id(self):X}>",
+        long = lambda self: f"<Command {('run' if getattr(self, '_notification', False) else 'cmd')} {getattr(self, '_cmd_name', '?')} {id(self):X}>",
+        short_det = lambda self: f"<{getattr(self, '_cmd_name', '?')}>",
+        long_det = lambda self: f"<Command {('run' if getattr(self, '_notification', False) else 'cmd')} {getattr(self, '_cmd_name', '?')}>",
     )
     class Command(metaclass=MetaCommand):
         """
@@ -71,10 +359,10 @@ def create_command_class_for_client(client):
 
         For details of the class structure see description of `MetaCommand`.
 
-        The object is a callable. Its call executes the command. The `result` property holds the result of the command,
-        however if it is attempted to read the `result` when it is not already known, the current thread will be blocked
-        until the result is known. If an error occured during execution, attempt to read the `result` will rise an
-        appropriate exception.
+        The object is a callable. Its call executes the command and returns a `CommandCall` -- the record of this
+        particular call, with its `result`. The object itself keeps no state of the calls, so it can be called from many
+        threads at once. For convenience the `result` and `wait` of the last call made through the object can be read
+        directly on the object.
         """
         # This should end in `_mupf`? Because they can be confused with command names
         _client_wr = weakref.ref(client)
@@ -82,126 +370,79 @@ def create_command_class_for_client(client):
 
         @loggable(log_results=False)
         def __init__(self, cmd_name, notification=False):
-            self._ccid = None
             self._cmd_name = cmd_name
             self._notification = notification
-            self._is_resolved = threading.Event()
-            self._result = NoResult
-            self._raw_result = None
-            self._is_error = False
+            self._timeout = None
+            self._last_call = None
 
         @loggable('()')
         def __call__(self, *args, **kwargs):
-            if self._cmd_name not in Command._legal_names:
-                pass
-            if self._is_resolved.is_set():
-                self._result = NoResult
-                self._raw_result = None
-                self._is_error = False
-                self._is_resolved.clear()
-            try:
-                with Command._global_mutex:
-                    # if Command._ccid_counter < 0:
-                    #     raise RuntimeError(f'`*last*` command was already sent, trying to send `{self._cmd_name}`(args={args}, kwargs={kwargs})')
-                    if self._ccid in Command._unresolved:
-                        # Trying to reissue a command when it is still unresolved, we must first clear the `_global_mutex`
-                        raise CommandReissueFast
-
-                    # TODO: Does this block need to be in the mutex?
-                    if self._cmd_name == '*first*':
-                        self._ccid = 0
-                    else:
-                        self._ccid = Command._ccid_counter
-                    if self._cmd_name == '*last*':
-                        Command._last_ccid = self._ccid
-
-                    if self._notification:
-                        self._is_resolved.set()
-                        self._result = NotificationNullResult
-                    else:
-                        Command._unresolved[self._ccid] = self
-
-                    Command._ccid_counter += 1
-            except CommandReissueFast:
-                # Previous call for the command is still unresolved and new call has been already made. We simply "copy"
-                # the command and call it.
-                # TODO: this needs to be reconsidered, because the behaviour is quite unpredictable here. Depending on
-                # the state of previous call of the command new instance is made or the `Command` object is reused. It
-                # is a problem with `self.result` because it is overwritten or duplicated depending on low-level
-                # communication timing.
-                return Command(self._cmd_name, self._notification)(*args, **kwargs)
-            if self._ccid > 0:
-                # The `*first*` command (`ccid==0`) is sent directly in the code of `bootstrap.js` so the data message
-                # through the websocket is suppressed here.
-                Command._client_wr()._send(self._jsonify(args, kwargs))
-
-            return self
+            return self._issue(self._notification, args, kwargs)
 
         @loggable()
         def run(self, *args, **kwargs):
-            ntf = self._notification
-            self._notification = True
-            self(*args, **kwargs)
-            self._notification = ntf
-            return self
+            return self._issue(True, args, kwargs)
 
         # client.command.print.notification('no result value')
 
-        @loggable()
-        def _jsonify(self, args, kwargs):
-            return [
-                (2 if self._notification else 0),   # Magic numbers: mode
-                self._ccid,
-                self._cmd_name,
-                {
-                    'args': args,
-                    'kwargs': kwargs,
-                },
-            ]
+        def with_timeout(self, timeout):
+            """ The same command, but its calls time out after `timeout` seconds
+
+            E.g. `client.command.fetch.with_timeout(2.0)(url).result`. It overrides `Client.command_timeout`, with
+            `None` the client's default is used.
+            """
+            command = Command(self._cmd_name, self._notification)
+            command._timeout = timeout
+            return command
+
+        def _issue(self, notification, args, kwargs):
+            call = self._new_call(notification)
+            if call._ccid > 0:
+                # The `*first*` command (`ccid==0`) is sent directly in the code of `bootstrap.js` so the data message
+                # through the websocket is suppressed here.
+                if (batch := Command._batch_local.batch) is not None:
+                    batch._append(call, call._jsonify(args, kwargs))
+                else:
+                    Command._client_wr()._send(call._jsonify(args, kwargs))
+            return call
+
+        def _new_call(self, notification):
+            """ Makes a call with a ccid, registered as waiting for its response, but not sent """
+            call = CommandCall(self, notification)
+            # No lock is taken here: the ccid is taken from `itertools.count` and the call is registered with a single
+            # `dict` assignment, both are atomic. The server thread only pops from `_unresolved`, and a response cannot
+            # come before the call is sent, that is after it is registered.
+            if self._cmd_name == '*first*':
+                call._ccid = 0
+            else:
+                call._ccid = next(Command._ccids)
+            if self._cmd_name == '*last*':
+                Command._last_ccid = call._ccid
+
+            if notification:
+                call._is_resolved = True
+                call._result = NotificationNullResult
+            else:
+                timeout = self._timeout if self._timeout is not None else Command._default_timeout
+                if timeout is not None and call._ccid > 0:
+                    call._deadline = time.monotonic() + timeout
+                Command._unresolved[call._ccid] = call
+            self._last_call = call
+            return call
+
+        def _get_last_call(self):
+            if (call := self._last_call) is None:
+                raise RuntimeError(f'command `{self._cmd_name}` was not called yet')
+            return call
 
         @property
         @loggable()
         def wait(self):
-            self._is_resolved.wait()
-            return self
+            return self._get_last_call().wait
 
         @property
         @loggable('*.:')
         def result(self):
-            self.wait
-            self._resolve()
-            if self._is_error:
-                raise self._result
-            return self._result
-
-        def __next__(self):
-            if self._is_resolved.is_set():
-                self._resolve()
-                if self._is_error:
-                    raise self._result
-                raise StopIteration(self._result)
-
-        def _resolve(self, value=NoResult):
-            if self._result is not NoResult:
-                return
-            if value is NoResult:
-                mode, ccid, noun, pyld = Command._client_wr()._decode_crrcan_msg(self._raw_result)
-                value = pyld['result']
-            self._is_error = isinstance(value, Exception)
-            self._result = value
-
-        @loggable()
-        def is_in_bad_state(self):
-            if not self._is_resolved.is_set():
-                return True
-            if self._is_error:
-                return self._result
-            return False
-
-        def __await__(self):
-            return self
-
-        def __iter__(self):
-            return self
+            return self._get_last_call().result
 
     return Command
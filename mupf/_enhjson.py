@@ -1,4 +1,7 @@
-import io
+import array
+import base64
+import json
+import re
 from enum import Enum
 from . import _symbols as S
 
@@ -8,6 +11,7 @@ class OptPolicy(Enum):
     none = 0
     non_zero_count = 1
     always_count = 2
+    addresses = 3       # as `non_zero_count`, but with addresses of all escapes (`{"c":2,"a":[[1],["k",0]]}`)
 
 
 class JsonElement(Enum):
@@ -21,13 +25,20 @@ class JsonElement(Enum):
     Autonomous = 7      # object that provides `.enh_json_esc()` method
     EscapeBlock = 8     # a JSON array, but as an escape `["~@", 340]`
     DirectJson = 9      # a `byte` stream directly put into JSON (potentially malformed!)
+    Buffer = 10         # object supporting the buffer protocol, as a base64 escape `["~B", "AQID"]`
 
 
-def test_element_type(x) -> JsonElement:
+def _probe_element_type(x) -> JsonElement:
     if hasattr(x, 'keys') and callable(x.keys) and hasattr(x, '__getitem__'):
         return JsonElement.Object
     if isinstance(x, str):
         return JsonElement.String
+    try:
+        memoryview(x)
+    except TypeError:
+        pass
+    else:
+        return JsonElement.Buffer
     if hasattr(x, '__len__') and hasattr(x, '__getitem__'):
         return JsonElement.Array
     if isinstance(x, bool):
@@ -41,13 +52,95 @@ def test_element_type(x) -> JsonElement:
 
     return JsonElement.Unknown
 
+# Classification of values by their concrete type. It is filled lazily by `test_element_type()` with results of the
+# probes in `_probe_element_type()`, so each type is probed only once. Types whose classification is not determined by
+# the type alone should be registered explicitly with `register_element_type()`.
+_element_type_by_type = {
+    dict: JsonElement.Object,
+    list: JsonElement.Array,
+    tuple: JsonElement.Array,
+    str: JsonElement.String,
+    int: JsonElement.Number,
+    float: JsonElement.Number,
+    bool: JsonElement.Bool,
+    type(None): JsonElement.Null,
+    bytes: JsonElement.Buffer,
+    bytearray: JsonElement.Buffer,
+    memoryview: JsonElement.Buffer,
+    array.array: JsonElement.Buffer,
+}
+
+def register_element_type(type_, element: JsonElement):
+    """ Explicitly classify all values of the `type_` (but not of its subclasses) as `element`
+    """
+    if not isinstance(element, JsonElement):
+        raise TypeError(f'element must be a `JsonElement` member, got {element!r}')
+    _element_type_by_type[type_] = element
+
+def test_element_type(x) -> JsonElement:
+    try:
+        return _element_type_by_type[type(x)]
+    except KeyError:
+        pass
+    element = _probe_element_type(x)
+    # Classes are not cached, because they are classified by themselves (`IJsonEsc` subclasses) and not by their
+    # metaclass. The `Unknown` is not cached either, not to hold every type of callbacks etc. that ever went through.
+    if element != JsonElement.Unknown and not isinstance(x, type):
+        _element_type_by_type[type(x)] = element
+    return element
+
+# Names of JS typed arrays for the buffer formats (as in `struct` module) and item sizes. Buffers of other formats are
+# sent as bytes (`Uint8Array` on the JS-side)
+_typed_array_by_format = {
+    ('b', 1): 'Int8Array',
+    ('h', 2): 'Int16Array',
+    ('i', 4): 'Int32Array',
+    ('l', 4): 'Int32Array',
+    ('l', 8): 'BigInt64Array',
+    ('q', 8): 'BigInt64Array',
+    ('H', 2): 'Uint16Array',
+    ('I', 4): 'Uint32Array',
+    ('L', 4): 'Uint32Array',
+    ('L', 8): 'BigUint64Array',
+    ('Q', 8): 'BigUint64Array',
+    ('f', 4): 'Float32Array',
+    ('d', 8): 'Float64Array',
+}
+
+def _buffer_esc(x):
+    """ The escape tuple of an object supporting the buffer protocol
+
+    The content is sent in base64 as `["~B", data]` for bytes, or `["~B", data, name]` where `name` is the name of JS
+    typed array matching the format of the buffer (in native byte order).
+    """
+    view = memoryview(x)
+    if not view.c_contiguous:
+        view = memoryview(view.tobytes())
+    data = base64.b64encode(view).decode('ascii')
+    name = _typed_array_by_format.get((view.format.lstrip('@'), view.itemsize))
+    if name is None:
+        return 'B', data
+    return 'B', data, name
+
+def decode_buffer(data, name=None):
+    """ Decoder of the `"~B"` escape -- all JS buffers and typed arrays arrive as `bytes`
+    """
+    return base64.b64decode(data)
+
 class EnhancedBlock:
 
-    def __init__(self, value, explicit=False, opt=OptPolicy.non_zero_count):
+    def __init__(self, value, explicit=False, opt=OptPolicy.non_zero_count, refs=False):
         self.explicit = explicit
         self._opt = opt
         self.value = value
+        # With `refs` a repeated object (dict or list) is encoded as a back-reference `["~^", address]` to the place of
+        # its first occurrence. This also makes cyclic structures encodable.
+        self.refs = refs
+        self._ref_targets = {}
+        self._ref_sites = []
+        self._esc_depth = 0
         self._start_pos = None
+        self._header_written = False
         self._addr = []
         self._esc_count = 0
         self._values_count = 0
@@ -55,46 +148,91 @@ class EnhancedBlock:
         self._esc_positions = []
 
     def start(self, stream):
-        self._start_pos = stream.tell()
-        stream.write(b'["~",')
+        if self.explicit or self._opt == OptPolicy.always_count:
+            # The block is known to be needed up front -- the header is written right away
+            stream.write('["~",')
+            self._header_written = True
+        else:
+            # Whether the block is needed is known only at its end, so the header is deferred
+            self._header_written = False
+            self._start_pos = stream.reserve(self)
 
     def end(self, stream):
-        if self._opt == OptPolicy.none:
-            if self.explicit or self._esc_count > 0:
-                stream.write(b',{}]')
-                return True
-            else:
-                stream.seek(self._start_pos)
-                stream.write(b'\x00\x00\x00\x00\x00')
-                stream.seek(0,2)   # SEEK_END == 2
-                return False
-        elif self._opt == OptPolicy.non_zero_count:
-            if self.explicit or self._esc_count > 0:
-                stream.write(b',{"c":')
-                stream.write(str(self._esc_count).encode())
-                stream.write(b'}]')
-                return True
-            else:
-                stream.seek(self._start_pos)
-                stream.write(b'\x00\x00\x00\x00\x00')
-                stream.seek(0,2)   # SEEK_END == 2
-                return False
-        elif self._opt == OptPolicy.always_count:
-            stream.write(b',{"c":')
-            stream.write(str(self._esc_count).encode())
-            stream.write(b'}]')
+        if not isinstance(self._opt, OptPolicy):
+            raise ValueError(f'Unknown optimalization policy {repr(self._opt)}')
+        if self._opt == OptPolicy.always_count:
+            # The header is already written in `start()`
+            self._write_opt(stream)
+            return True
+        if self.explicit or self._esc_count > 0 or self._header_written:
+            self.write_header(stream)
+            self._write_opt(stream)
             return True
         else:
-            raise ValueError(f'Unknown optimalization policy {repr(self._opt)}')
+            stream.release(self)
+            return False
+
+    def _write_opt(self, stream):
+        """ Write the optimization information object (and the end of the block)
+        """
+        separator = ''
+        stream.write(',{')
+        if self._opt != OptPolicy.none:
+            stream.write('"c":')
+            stream.write(str(self._esc_count))
+            separator = ','
+        if self._opt == OptPolicy.addresses:
+            stream.write(separator)
+            stream.write('"a":')
+            _write_addresses(self._esc_addreses, stream)
+            separator = ','
+        if self._ref_sites:
+            stream.write(separator)
+            stream.write('"r":')
+            _write_addresses(self._ref_sites, stream)
+        stream.write('}]')
+
+    def write_header(self, stream):
+        """ Fill in the deferred header
+
+        It is called by the block itself when it turns out to be needed, or by the `stream` when the reserved header
+        must be sent before the block ends (in `iterencode()`). In the latter case the block is encoded as if it were
+        explicit.
+        """
+        if not self._header_written:
+            stream.release(self)
+            stream.fill(self._start_pos, '["~",')
+            self._header_written = True
 
     def esc_here(self, handler, stack, stream):
         self.nested_eb_ends_here()
+        self._esc_depth += 1
         stack.append([1, True, handler])  # mode == 1 == 'esc'
-        stream.write(b'["~')
-        if isinstance(handler, str):
-            handler = handler.encode('utf-8')
+        stream.write('["~')
+        if isinstance(handler, bytes):
+            handler = handler.decode('utf-8')
         stream.write(handler)
-        stream.write(b'",')
+        stream.write('",')
+
+    def esc_ends_here(self):
+        self._esc_depth -= 1
+        self.addr_pop()
+
+    def ref_here(self, value):
+        """ Check if the object `value` (dict or list) was already encoded in this block
+
+        Returns the address of its first occurrence or `None`. Objects inside escape structures are not referenced at
+        all, because their addresses do not survive the decoding of the escape.
+        """
+        if self._esc_depth:
+            return None
+        key = id(value)
+        if key in self._ref_targets:
+            self._ref_sites.append(self._addr.copy())
+            return self._ref_targets[key][1]
+        # The object is kept, so its `id()` cannot be reused by another object during the encoding
+        self._ref_targets[key] = (value, self._addr.copy())
+        return None
 
     def nested_eb_ends_here(self):
         self._esc_count += 1
@@ -113,6 +251,22 @@ class EnhancedBlock:
     def addr_pop(self):
         self._addr.pop()
 
+def _write_addresses(addresses, stream):
+    stream.write('[')
+    for n, addr in enumerate(addresses):
+        if n:
+            stream.write(',')
+        stream.write('[')
+        for m, key in enumerate(addr):
+            if m:
+                stream.write(',')
+            if isinstance(key, str):
+                _encode_string(key, stream)
+            else:
+                stream.write(str(key))
+        stream.write(']')
+    stream.write(']')
+
 # Lookup table of arbitrary bytes into JSON-compatibile string representation
 _string_esc = [
     b'\\u0000', b'\\u0001', b'\\u0002', b'\\u0003', b'\\u0004', b'\\u0005', b'\\u0006', b'\\u0007',
@@ -149,12 +303,98 @@ _string_esc = [
     b'\xF8',    b'\xF9',    b'\xFA',    b'\xFB',    b'\xFC',    b'\xFD',    b'\xFE',    b'\xFF',
 ]
 
+# Only control characters, `"` and `\` need escaping. All other characters (including non-ASCII ones, which the
+# table above passes through as raw UTF-8) are copied as-is. Instead of a `write()` per byte, the whole string is
+# escaped at once and only the escapable characters actually present in it are replaced, one C-level `bytes.replace()`
+# per distinct character. The backslash goes first, so the backslashes introduced by other escapes are not escaped
+# again. The replacing is done on UTF-8, because `bytes.replace()` is several times faster than `str.replace()`.
+_string_esc_order = [0x5C, *range(0x20), 0x22]
+_re_string_esc = re.compile(r'[\x00-\x1f"\\]')
+
+def _escape_bytes(data):
+    for i in _string_esc_order:
+        if i in data:
+            data = data.replace(bytes((i,)), _string_esc[i])
+    return data
+
 def _encode_string(s, stream):
-    global _string_esc
-    stream.write(b'"')
-    for i in str(s).encode('utf-8'):
-        stream.write(_string_esc[i])
-    stream.write(b'"')
+    data = str(s)
+    # Short strings (usually not needing any escapes) are checked with a single regexp search. For long ones the
+    # `memchr()` scans of `_escape_bytes()` are cheaper.
+    if len(data) > 1024 or _re_string_esc.search(data):
+        data = _escape_bytes(data.encode('utf-8')).decode('utf-8')
+    stream.write('"')
+    stream.write(data)
+    stream.write('"')
+
+
+class _Output:
+    """ Output buffer of the encoder
+
+    It collects `str` fragments and joins them only once, in `getvalue()` (or in `take_chunks()` for `iterencode()`). A
+    fragment can be reserved and filled in later -- this is how the header of an `EnhancedBlock` is deferred until it is
+    known whether the block is needed at all. A reserved fragment that is never filled stays empty.
+
+    The length of the buffer is kept for `take_chunks()`. The `write()` is the bare `list.append()`, so the written
+    fragments are counted in `take_chunks()` -- each of them only once, `_measured` is the number of the already counted
+    ones, and `_length` is their total length.
+    """
+
+    def __init__(self):
+        self._fragments = []
+        self.write = self._fragments.append
+        self._reserved_by = []
+        self._next_size_check = 0
+        self._measured = 0
+        self._length = 0
+
+    def reserve(self, block):
+        # An empty fragment does not change the length
+        self._fragments.append('')
+        self._reserved_by.append(block)
+        return len(self._fragments) - 1
+
+    def release(self, block):
+        # Blocks are nested, so the releasing block is always the last one, unless it was already released
+        if self._reserved_by and self._reserved_by[-1] is block:
+            self._reserved_by.pop()
+
+    def fill(self, pos, data):
+        if pos < self._measured:
+            self._length += len(data) - len(self._fragments[pos])
+        self._fragments[pos] = data
+
+    def getvalue(self):
+        return ''.join(self._fragments)
+
+    def take_chunks(self, chunk_size, final=False):
+        """ Take all complete `chunk_size` long chunks out of the buffer (or everything, if `final`)
+
+        The buffer is measured only once per `_SIZE_CHECK_INTERVAL` fragments, and only the fragments written since the
+        last measurement are counted. All reserved headers are filled before the chunks are taken, because the data
+        following them is going to be sent.
+        """
+        if not final:
+            if len(self._fragments) < self._next_size_check:
+                return ()
+            self._next_size_check = len(self._fragments) + _SIZE_CHECK_INTERVAL
+            self._length += sum(map(len, self._fragments[self._measured:]))
+            self._measured = len(self._fragments)
+            if self._length < chunk_size:
+                return ()
+        reserved_by, self._reserved_by = self._reserved_by, []
+        for block in reserved_by:
+            block.write_header(self)
+        data = ''.join(self._fragments)
+        end = len(data) if final else len(data) - len(data) % chunk_size
+        self._fragments.clear()
+        self._fragments.append(data[end:])
+        self._next_size_check = _SIZE_CHECK_INTERVAL
+        self._measured = 1
+        self._length = len(data) - end
+        return [data[i:i+chunk_size] for i in range(0, end, chunk_size)]
+
+_SIZE_CHECK_INTERVAL = 256
 
 #  Encoding is done on a stack machine. The main loop consists of two stages: first, the stack is populated with frames
 #  by consuming the input, and secopnd, the stack is processed. If the stack is not empty on the end of processing the
@@ -200,14 +440,89 @@ def _encode_string(s, stream):
 # appropriate API has been provided, they will be wrapped into appropriate wrapper escape block. This escape block can
 # be easily recognized on decoding, and escaped values substitued with objects.
 
-def encode(value, *, escape=test_element_type):
-    result = io.BytesIO()
+class _EscapeNeeded(Exception):
+    pass
+
+def _fast_path_default(x):
+    # Blocks which would be dropped if there are no escapes inside are transparent. Any other object not known to the
+    # C encoder may need an escape, so the fast path is abandoned.
+    if (    isinstance(x, EnhancedBlock)
+        and not x.explicit
+        and x._opt != OptPolicy.always_count
+        and not x.refs
+        and not isinstance(x.value, EnhancedBlock)
+    ):
+        return x.value
+    raise _EscapeNeeded()
+
+_fast_path_encoder = json.JSONEncoder(
+    ensure_ascii=False,
+    allow_nan=False,
+    separators=(',', ':'),
+    default=_fast_path_default,
+)
+
+# The `json` module writes `\u00XX` escapes of control characters in lowercase, the `_string_esc` in uppercase. The
+# escaped backslashes are matched too, so the `\u` is matched only where it really is an escape.
+_re_json_lowercase_esc = re.compile(r'\\(\\|u00[01][a-f])')
+
+def _uppercase_esc(match):
+    esc = match.group(0)
+    return esc[:4] + esc[4:].upper()
+
+def _fast_encode(value):
+    """ Try to encode an escape-free `value` with the C encoder of the `json` module
+
+    Returns `None` if the `value` (possibly) needs the stack machine of `iterencode()`: there is an object of type not
+    known to the `json` module, a float out of the JSON range, a key of unsupported type, an array that would have
+    to be escaped with `"~~"` (its JSON starts with `["~`, which cannot occur anywhere else in compact JSON), or a
+    `True`/`False`/`None` key (written by `json` as `"true":` etc., but as `"True":` etc. by the stack machine). The
+    keys are checked in the result, so a `str` key `"true"` also takes the slow path, which is harmless.
+    """
+    try:
+        result = _fast_path_encoder.encode(value)
+    except (_EscapeNeeded, TypeError, ValueError):
+        return None
+    if '["~' in result or '"true":' in result or '"false":' in result or '"null":' in result:
+        return None
+    if '\\u00' in result:
+        result = _re_json_lowercase_esc.sub(_uppercase_esc, result)
+    return result
+
+def encode(value, *, escape=test_element_type, fast_path=None):
+    # With `chunk_size=None` there is exactly one chunk, and joining a single string does not copy it
+    return ''.join(iterencode(value, escape=escape, chunk_size=None, fast_path=fast_path))
+
+def iterencode(value, *, escape=test_element_type, chunk_size=65536, fast_path=None):
+    """ Encode the `value` yielding chunks of the result
+
+    All chunks are `chunk_size` characters long except for the last one, so the whole result never needs to be held in
+    memory. With `chunk_size=None` the result is yielded as a single chunk. Note that an `EnhancedBlock` which is still
+    open when a chunk is taken is encoded as explicit (with its header), even if it would be discarded by `encode()`.
+    The decoded value is the same.
+
+    With `fast_path` the `value` is first optimistically encoded by the C encoder of the `json` module, and only if it
+    turns out to need escapes, it is encoded again by the stack machine. It is valid only for `escape` functions which
+    escape nothing of builtin types `json` module knows (as does `test_element_type()`, for which it is the default).
+    """
+    if fast_path is None:
+        fast_path = (escape is test_element_type)
+    if fast_path and (encoded := _fast_encode(value)) is not None:
+        if chunk_size is None:
+            yield encoded
+        else:
+            for pos in range(0, len(encoded), chunk_size):
+                yield encoded[pos:pos+chunk_size]
+        return
+    result = _Output()
     current_value = value
     stack = []
     current_enhanced_block = None
     #
     # This loop is never broken -- when the stack is empty, we jump out of this function altogether
     while True:
+        if chunk_size is not None:
+            yield from result.take_chunks(chunk_size)
         if isinstance(current_value, EnhancedBlock):
             # `EnhancedBlock` object act just as a wrapper for a value, but its occurence in the encoded structure
             # switches on the enhanced mode, where atypical objects can be encoded with escape structures.
@@ -241,12 +556,26 @@ def encode(value, *, escape=test_element_type):
                 current_type = JsonElement.EscapeBlock
                 esc_result = ("?", "IllformedEscTupleError", repr(esc_result)[:MAXERRREPR])
         #
+        # Buffers are escaped only in the enhanced mode. Otherwise they are encoded as arrays of their items, as any
+        # other sequence.
+        if current_type == JsonElement.Buffer and not current_enhanced_block:
+            current_type = JsonElement.Array
+        #
+        # A repeated dict or list is replaced by a back-reference to its first occurrence, if the block wants so
+        if (    current_enhanced_block
+            and current_enhanced_block.refs
+            and (current_type == JsonElement.Object or current_type == JsonElement.Array)
+            and (target := current_enhanced_block.ref_here(current_value)) is not None
+        ):
+            current_type = JsonElement.EscapeBlock
+            esc_result = ('^', target)
+        #
         # Now the "type" is known, and we can proceed acordingly. Note that `JsonElement.Autonomous` type is never
         # passed on, becouse it is casted to `JsonElement.EscapeBlock`
         if current_type == JsonElement.Object:
             keys = current_value.keys()
             stack.append([3, current_value, (k for k in keys), True])    # mode == 3 == 'obj'
-            result.write(b'{')
+            result.write('{')
             if current_enhanced_block:
                 current_enhanced_block.addr_append(None)
         elif current_type == JsonElement.String:
@@ -272,25 +601,28 @@ def encode(value, *, escape=test_element_type):
                 current_value = (current_value,)
             else:    # Not in enhanced mode or no collision or inside the "~~" escape -- start regular array
                 stack.append([2, current_value, (n for n in range(length)), True])    # mode == 2 == 'arr'
-                result.write(b'[')
+                result.write('[')
                 if current_enhanced_block:
                     current_enhanced_block.addr_append(None)
         elif current_type == JsonElement.Bool:
-            result.write(b'true' if current_value else b'false')
+            result.write('true' if current_value else 'false')
         elif current_type == JsonElement.Null:
-            result.write(b'null')
+            result.write('null')
         elif current_type == JsonElement.Number:
-            result.write(str(current_value).encode())
+            result.write(str(current_value))
         elif current_type == JsonElement.Unknown:
             current_type = JsonElement.EscapeBlock
             esc_result = ("?", "UnknownObjectError", repr(current_value)[:MAXERRREPR])
             # Despite the effort it is still clasiffied as `JsonElement.Unknown`
+        elif current_type == JsonElement.Buffer:
+            current_type = JsonElement.EscapeBlock
+            esc_result = _buffer_esc(current_value)
         elif current_type == JsonElement.DirectJson:
             if not isinstance(current_value, bytes):
                 current_type = JsonElement.EscapeBlock
                 esc_result = ("?", "BadDirectJsonValueError")
             else:
-                result.write(current_value)
+                result.write(current_value.decode('utf-8'))
         elif current_type != JsonElement.EscapeBlock:
             # That should never be written. Someone subclassed `JsonElement`?
             current_type = JsonElement.EscapeBlock
@@ -305,9 +637,9 @@ def encode(value, *, escape=test_element_type):
                 # mode.
                 current_value = esc_result[1:]
             else:
-                result.write(b'["~",["~?","NoEnhJSONBlockError",')
+                result.write('["~",["~?","NoEnhJSONBlockError",')
                 _encode_string(repr(esc_result)[:MAXERRREPR], result)
-                result.write(b'],{"e":true}]')
+                result.write('],{"e":true}]')
         #
         # Here we inform the enhanced block that a normal value has been encoded.  This is done to give the EB data on
         # the position of escape structures inside all of the data, so it could choose apropriate optimization strategy.
@@ -341,9 +673,9 @@ def encode(value, *, escape=test_element_type):
                         continue
                     else:
                         # Second pass: end of handler-escape structure, remove frame from stack
-                        result.write(b']')
+                        result.write(']')
                         if current_enhanced_block:
-                            current_enhanced_block.addr_pop()
+                            current_enhanced_block.esc_ends_here()
                         stack.pop()
                         continue
                 else:                                 # mode: 'arr' | 'obj' | 'ufa' -- dict-like or list-like elements
@@ -351,9 +683,9 @@ def encode(value, *, escape=test_element_type):
                         key = next(stack[-1][2])
                     except StopIteration:             # no more keys -- end the structure, remove frame from the stack
                         if stack[-1][0] == 3:         # mode == 3 == 'obj'
-                            result.write(b'}')
+                            result.write('}')
                         elif stack[-1][0] == 2:
-                            result.write(b']')
+                            result.write(']')
                         if current_enhanced_block and stack[-1][0]!=4:
                             current_enhanced_block.addr_pop()
                         stack.pop()
@@ -362,7 +694,7 @@ def encode(value, *, escape=test_element_type):
                         if stack[-1][3]:    # is it the first element of this container?
                             stack[-1][3] = False   # Next element won't be the first one
                         else:
-                            result.write(b',')     # put the separator
+                            result.write(',')     # put the separator
                         if current_enhanced_block:
                             # the key in object is always a string in JSON, even if it is an int in Python so the `if`
                             # below is done to distingish arrays indices from object keys (by their type: str - object,
@@ -375,13 +707,17 @@ def encode(value, *, escape=test_element_type):
                         if stack[-1][0] == 3: # mode == 3 == 'obj'
                             # Print the key for the object structure
                             _encode_string(key, result)
-                            result.write(b':')
+                            result.write(':')
                         # Now stack is in cleaned condition, but still not empty We can obtain current structure element
                         # that need to be encoded now:
                         current_value = stack[-1][1][key]
                         break
             else:        # The stack is now empty -- the work is done
-                return result.getvalue().translate(None, delete=b'\x00').decode('utf-8')
+                if chunk_size is None:
+                    yield result.getvalue()
+                else:
+                    yield from result.take_chunks(chunk_size, final=True)
+                return
 
 
 class IJsonEsc:
@@ -409,19 +745,66 @@ class Infinity(IJsonEsc):
 
 def decode_enhblock(value, esc_decoders):
     if isinstance(value, list) and isinstance(value[0], str) and value[0] == "~":
-        return decode(value[1], esc_decoders)
+        return _decode_explicit_enhblock(value, esc_decoders)
+    return value
+
+class _BackRef:
+    """ Decoded `["~^", address]` escape, replaced by the referenced object when the whole block is decoded
+    """
+    __slots__ = ('address',)
+
+    def __init__(self, address):
+        self.address = address
+
+def _at_address(value, address):
+    for key in address:
+        value = value[key]
+    return value
+
+def _decode_explicit_enhblock(value, esc_decoders):
+    """ Decode the explicit enhanced block `["~", value, opt]`
+
+    If the `opt` holds addresses of the escapes (`"a"`, see `OptPolicy.addresses`), only the addressed subtrees are
+    decoded (in place) and the rest of the value is left untouched. Otherwise the whole value is decoded. Finally, the
+    back-references at the addresses listed in `"r"` are replaced by the objects they refer to.
+    """
+    opt = value[2] if len(value) > 2 and isinstance(value[2], dict) else {}
+    if isinstance(opt.get('a'), list):
+        result = _decode_addressed(value[1], opt['a'], esc_decoders)
+    else:
+        result = decode(value[1], esc_decoders)
+    for site in opt.get('r', ()):
+        parent = _at_address(result, site[:-1])
+        parent[site[-1]] = _at_address(result, parent[site[-1]].address)
+    return result
+
+def _decode_addressed(value, addresses, esc_decoders):
+    last = None
+    for addr in addresses:
+        # Addresses are in the order of encoding, so the escapes nested in an already decoded subtree follow it
+        if last is not None and addr[:len(last)] == last:
+            continue
+        if not addr:
+            return decode(value, esc_decoders)
+        parent = value
+        for key in addr[:-1]:
+            parent = parent[key]
+        parent[addr[-1]] = decode(parent[addr[-1]], esc_decoders)
+        last = addr
     return value
 
 def decode(value, esc_decoders):
     if isinstance(value, list):
         esc_like_array = len(value) >= 2 and isinstance(value[0], str)
         if esc_like_array and value[0] == "~":
-            return decode(value[1], esc_decoders)
+            return _decode_explicit_enhblock(value, esc_decoders)
         if esc_like_array and value[0].startswith("~"):
             if  value[0] == "~-":
                 return value[1]
             elif value[0] == "~~":
                 return [decode(x, esc_decoders) for x in value[1]]
+            elif value[0] == "~^":
+                return _BackRef(value[1])
             else:
                 return esc_decoders[value[0][1:]](*[decode(x, esc_decoders) for x in value[1:]])
         else:
@@ -45,6 +45,8 @@ verbose_macros = __Feature('verbose_macros', False)
 friendly_obj_names = __Feature('friendly_obj_names', False)
 safe_dunders = __Feature('safe_dunders', True)
 garbage_collection = __Feature('garbage_collection', True)
+binary_framing = __Feature('binary_framing', False)
+shared_refs = __Feature('shared_refs', False)
 
 test_feature = __Feature('test_feature', True)
 another_test_feat = __Feature('another_test_feat', False)
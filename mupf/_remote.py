@@ -54,6 +54,8 @@ class RemoteObj(metaclass=FinalClass):
         automatically stripped of `weakref` if needed.
         """
         if isinstance(key, S._Symbol):
+            if key == S.aio:
+                return AsyncRemoteObj(self)
             item = object.__getattribute__(self, key.internal_name)
             return item() if key.weakref else item
         else:
@@ -94,10 +96,42 @@ class RemoteObj(metaclass=FinalClass):
         command = self[S.command]
         # 1. some mutex here? because `command` may dissapear
         rid = self[S.rid]
-        if command is not None and rid != 0 and self[S.client]._healthy_connection:    # do not try to GC the `window`
+        client = self[S.client]
+        # do not try to GC the `window`, the client and its command class may be collected before the object
+        if command is not None and client is not None and rid != 0 and client._healthy_connection:
             command('*gc*').run(rid).result
 
 
+class AsyncRemoteObj:
+    """ Asynchronous interface of a `RemoteObj`, given by `obj[S.aio]`
+
+    The `obj[S.aio].key`, `obj[S.aio][key]` and `obj[S.aio](arg1, arg2, ...)` syntax issue the same commands as the
+    respective syntax of `RemoteObj`, but the commands are returned instead of their results. The commands are
+    awaitable, e.g. `body = await window[S.aio].document` and then `await body[S.aio].appendChild(...)` in a coroutine.
+    """
+    __slots__ = ('_obj',)
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def __getattr__(self, key):
+        return self._obj[S.command]('*get*')(self._obj, key)
+
+    def __getitem__(self, key):
+        return self._obj[S.command]('*get*')(self._obj, key)
+
+    def __call__(self, *args):
+        return self._obj[S.command]('*call*')(*args, id=self._obj[S.rid], this_=self._obj[S.this])
+
+    def set(self, key, value):
+        """ Awaitable `obj[key] = value`
+        """
+        return self._obj[S.command]('*set*')(self._obj, key, value)
+
+    def __repr__(self):
+        return f"<AsyncRemoteObj of {self._obj!r}>"
+
+
 @loggable(
     'remote.py/*<obj>',
     short = lambda self: f"<{getattr(self, '_ccid', '?')}>",
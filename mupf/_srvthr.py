@@ -10,9 +10,17 @@ The `Client_SrvThrItf._websocket_communication()` method is the propper heart of
 """
 
 import asyncio
+import collections
+import enum
+import itertools
+import json
 import websockets
+import websockets.extensions.base
+import websockets.extensions.permessage_deflate
+import websockets.framing
 from .log import loggable
 import re
+import struct
 import threading
 import abc
 from http import HTTPStatus
@@ -26,7 +34,6 @@ class _WSTT:
     A helper class keeping names of tasks used in the websocket coroutine.
     """
     recieve_data ='recieve_data'
-    consume_outqueue = 'consume_outqueue'
     send_data = 'send_data'
 
 
@@ -35,7 +42,20 @@ class _CrrcanMode:
 
     A helper class keeping magic numbers of CRRCAN protocol modes.
     """
-    cmd = 0; res = 1; run = 2; clb = 5; ans = 6; ntf = 7
+    cmd = 0; res = 1; run = 2; cnl = 3; chk = 4; clb = 5; ans = 6; ntf = 7
+    bdl = 8; grp = 9
+
+
+class OutqueuePolicy(enum.Enum):
+    """ What to do when a message is sent, and the outgoing queue of a client is full
+
+    `block` blocks the sending thread until there is room on the queue, `error` raises `exceptions.OutqueueFullError`,
+    and `drop_notifications` drops the oldest notification (`.run()` message) waiting on the queue -- if there is no
+    notification to drop, the sending thread is blocked.
+    """
+    block = 0
+    error = 1
+    drop_notifications = 2
 
 
 class BadCRRCANMessageError(Exception):
@@ -51,55 +71,247 @@ re_crrcan_noun = re.compile(r'\s*(-?\d+|"(?:\\"|[^"])*")\s*,')
 The groups in the regexp allow for quick extracting of the `mode` and `ccid` of the message
 """
 
+_crrcan_header = struct.Struct('<BiB')
+_crrcan_int_noun = struct.Struct('<i')
+_crrcan_str_noun_length = struct.Struct('<H')
+
+def pack_crrcan_header(mode, ccid, noun) -> bytes:
+    """ The header of a binary framed CRRCAN message
+
+    All numbers are little-endian. The header is `mode` (uint8), `ccid` (int32), type of the noun (uint8) and the noun --
+    either int32 (type 0), or uint16 length and UTF-8 bytes of a string (type 1). The payload (JSON in UTF-8) follows.
+    """
+    if isinstance(noun, str):
+        noun = noun.encode('utf-8')
+        return _crrcan_header.pack(mode, ccid, 1) + _crrcan_str_noun_length.pack(len(noun)) + noun
+    return _crrcan_header.pack(mode, ccid, 0) + _crrcan_int_noun.pack(noun)
+
+def unpack_crrcan_header(data: bytes):
+    """ Unpacks the header of a binary framed CRRCAN message
+
+    Returns a tuple of `mode`, `ccid`, `noun` and the offset of the payload in `data`.
+    """
+    mode, ccid, noun_type = _crrcan_header.unpack_from(data)
+    offset = _crrcan_header.size
+    if noun_type == 0:
+        noun, = _crrcan_int_noun.unpack_from(data, offset)
+        return mode, ccid, noun, offset + _crrcan_int_noun.size
+    elif noun_type == 1:
+        length, = _crrcan_str_noun_length.unpack_from(data, offset)
+        offset += _crrcan_str_noun_length.size
+        return mode, ccid, data[offset:offset+length].decode('utf-8'), offset + length
+    raise BadCRRCANMessageError(f'unknown type of noun in the binary header ({noun_type!r})')
+
+class ParsedMessage(list):
+    """ A CRRCAN message already parsed from JSON, with its payload not decoded yet
+
+    Such messages are passed to the main thread by the server thread (with the `parse_once` option of `App`, and the
+    messages of bundles). The payload is decoded in the thread which uses the message (see `Client._decode_crrcan_msg`),
+    only once -- the decoded message is kept in `decoded`.
+    """
+    decoded = None
+
+def parse_crrcan_message(data):
+    """ Parses a text or binary framed CRRCAN message into a `ParsedMessage`
+    """
+    if isinstance(data, bytes):
+        mode, ccid, noun, payload_start = unpack_crrcan_header(data)
+        return ParsedMessage((mode, ccid, noun, json.loads(data[payload_start:])))
+    msg = json.loads(data)
+    if not isinstance(msg, list) or len(msg) != 4:
+        raise BadCRRCANMessageError('bad message format (`[<mode>,<ccid>,<noun>,<payload>]`)')
+    return ParsedMessage(msg)
+
+def bundle_crrcan_messages(data_list, max_size):
+    """ Coalesces text messages into bundle messages
+
+    A bundle is `[8,-1,<count>,[<message>,<message>,...]]` and it is unpacked by `mupf.recv` in order. The messages are
+    already encoded, so they are only joined. Binary and fragmented messages are not bundled -- they are left in place,
+    and a bundle is never longer than `max_size` (unless it is a single message). Returns the list of data to send.
+    """
+    result = []
+    texts = []
+    size = 0
+    for data in data_list:
+        if isinstance(data, str) and (not texts or size + len(data) < max_size):
+            texts.append(data)
+            size += len(data) + 1
+            continue
+        if texts:
+            result.append(_bundle(texts))
+        if isinstance(data, str):
+            texts = [data]
+            size = len(data) + 1
+        else:
+            texts = []
+            size = 0
+            result.append(data)
+    if texts:
+        result.append(_bundle(texts))
+    return result
+
+class ChunkedMessage(collections.deque):
+    """ The chunk messages of a long message, in order
+
+    The chunks are sent interleaved with other messages (see `Client_SrvThrItf.__writer`), so the messages sent after
+    a long message do not wait until all of it is sent. The chunks can be put by the sending thread while the message is
+    still being encoded (see `Client_SrvThrItf._send_chunked`), and all of them are there when `done` is set. The
+    chunks are taken by the writer, both sides under the `_outqueue_cond` of the client.
+    """
+    done = False
+
+# At most this many chunks of a message being encoded wait for sending, see `Client_SrvThrItf._send_chunked`
+_CHUNK_STREAM_DEPTH = 4
+
+def _chunk(piece, stream_id, more):
+    """ A chunk message, `more` is `1` if more chunks follow, `0` for the last one, and `-1` if the message is abandoned
+    """
+    if isinstance(piece, bytes):
+        return pack_crrcan_header(_CrrcanMode.chk, stream_id, more) + piece
+    return f'[{_CrrcanMode.chk},{stream_id},{more},{json.dumps(piece, ensure_ascii=False)}]'
+
+def chunk_crrcan_message(pieces, stream_id):
+    """ Wraps the pieces of an encoded CRRCAN message into chunk messages
+
+    A chunk is `[4,<stream id>,<more>,"<piece>"]`, where `more` is `1` for all chunks but the last one. The binary
+    framed pieces (`bytes`) get a binary header instead, and their payload is the piece itself. The receiving side
+    joins the pieces of a stream and processes the message when its last chunk comes. Returns a complete
+    `ChunkedMessage`.
+    """
+    result = ChunkedMessage()
+    last = len(pieces) - 1
+    for n, piece in enumerate(pieces):
+        result.append(_chunk(piece, stream_id, int(n < last)))
+    result.done = True
+    return result
+
+def _is_chunk(data):
+    if isinstance(data, bytes):
+        return data[:1] == b'\x04'
+    return data.startswith('[4,')
+
+def _bundle(texts):
+    if len(texts) == 1:
+        return texts[0]
+    return f'[{_CrrcanMode.bdl},-1,{len(texts)},[' + ','.join(texts) + ']]'
+
+class _CompressionThreshold(websockets.extensions.base.Extension):
+    """ The per-message deflate extension which sends the messages shorter than `threshold` bytes uncompressed
+
+    The compression of a message is optional for the sender (RFC 7692), so the other side needs no setup. Only the
+    unfragmented messages are left uncompressed, because the first frame of a message decides for all of them.
+    """
+
+    def __init__(self, extension, threshold):
+        self._extension = extension
+        self._threshold = threshold
+
+    @property
+    def name(self):
+        return self._extension.name
+
+    def decode(self, frame, *, max_size=None):
+        return self._extension.decode(frame, max_size=max_size)
+
+    def encode(self, frame):
+        if frame.fin and frame.opcode in (websockets.framing.OP_TEXT, websockets.framing.OP_BINARY) \
+                and len(frame.data) < self._threshold:
+            return frame
+        return self._extension.encode(frame)
+
+
+class _PerMessageDeflateFactory(websockets.extensions.permessage_deflate.ServerPerMessageDeflateFactory):
+
+    def __init__(self, threshold, **kwargs):
+        super().__init__(**kwargs)
+        self._threshold = threshold
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        if self._threshold > 0:
+            extension = _CompressionThreshold(extension, self._threshold)
+        return response_params, extension
+
+
 class App_SrvThrItf(abc.ABC):
 
     def __init__(self):
         # The main event loop of the App. However, if event-loop cannot be done this holds an offending exception
         self._event_loop: asyncio.BaseEventLoop = None
-        self._server_opened_mutex = threading.Event()
-        self._server_closed_mutex = threading.Event()
-
-    def _server_thread_body(self):
+        # All event loops (the main one is the first), one per server thread, with the same convention for exceptions.
+        # The loop of index `n` serves the port `self._port + n`.
+        self._event_loops: list = []
+        # The events of opening and closing of each server thread
+        self._server_opened_mutexes: list[threading.Event] = []
+        self._server_closed_mutexes: list[threading.Event] = []
+
+    def _websocket_extensions(self):
+        """ The websocket extensions offered to the clients, configured with the options of `App`
+        """
+        if not self._compression:
+            return []
+        return [_PerMessageDeflateFactory(
+            threshold = self._compression_threshold,
+            server_max_window_bits = self._compression_window_bits,
+            client_max_window_bits = self._compression_window_bits,
+            compress_settings = {'level': self._compression_level},
+        )]
+
+    def _server_thread_body(self, index=0):
         """ Main body of the server, run in a separate thread in `self.open()`
+
+        With more than one server thread (see `loop_threads` of `App`), each one runs its own event loop and serves its
+        own port. The `index` is the number of the thread, `0` is the main one.
         """
-        log_server_event('entering server thread body')
-        self._event_loop = asyncio.new_event_loop()
-        log_server_event('creating event loop', eloop=self._event_loop)
-        asyncio.set_event_loop(self._event_loop)
+        log_server_event('entering server thread body', index=index)
+        event_loop = asyncio.new_event_loop()
+        self._event_loops[index] = event_loop
+        if index == 0:
+            self._event_loop = event_loop
+        log_server_event('creating event loop', eloop=event_loop)
+        asyncio.set_event_loop(event_loop)
         log_server_event('creating server object')
         start_server = websockets.serve(
             ws_handler = self._websocket_request,
             host = self._host,
-            port = self._port,
+            port = self._port + index,
             process_request = self._process_HTTP_request,
+            max_size = self._max_size,
+            max_queue = self._max_queue,
+            read_limit = self._read_limit,
+            write_limit = self._write_limit,
+            compression = None,
+            extensions = self._websocket_extensions(),
         )
         server = None
         try:
             log_server_event('server starting ...')
-            server = self._event_loop.run_until_complete(start_server)
+            server = event_loop.run_until_complete(start_server)
             log_server_event('server started', server)
-            self._server_opened_mutex.set()
+            self._server_opened_mutexes[index].set()
             log_server_event('server open state mutex set', server)
             # Here everything happens
-            self._event_loop.run_forever()
+            event_loop.run_forever()
             # This loop is broken in `App.close()`
-            log_server_event('event loop main run ended', server, eloop=self._event_loop)
+            log_server_event('event loop main run ended', server, eloop=event_loop)
         except OSError as err:
             log_server_event('server OSError', err, server)
-            self._event_loop = err
+            self._event_loops[index] = err
+            if index == 0:
+                self._event_loop = err
         finally:
             if server is None:
-                self._server_opened_mutex.set()
+                self._server_opened_mutexes[index].set()
                 log_server_event('server open state mutex set', server)
             else:
                 log_server_event('server closing ...', server)
                 server.close()
                 log_server_event('server closed', server)
-                self._event_loop.run_until_complete(server.wait_closed())
-                log_server_event('event loop completed', server, eloop=self._event_loop)
-                self._event_loop.close()
-                log_server_event('event loop closed', server, eloop=self._event_loop)
-                self._server_closed_mutex.set()
+                event_loop.run_until_complete(server.wait_closed())
+                log_server_event('event loop completed', server, eloop=event_loop)
+                event_loop.close()
+                log_server_event('event loop closed', server, eloop=event_loop)
+                self._server_closed_mutexes[index].set()
                 log_server_event('server close state mutex set', server)
         log_server_event('exiting server thread body', server)
 
@@ -114,7 +326,12 @@ class App_SrvThrItf(abc.ABC):
         log_websocket_event('entering websocket request body', new_websocket, path=path)
         url, cid = self._process_url(path)
         log_websocket_event('websocket path information', new_websocket, cid=cid, url=url)
-        if the_client := self._get_client_by_cid(cid):
+        if (the_client := self._get_client_by_cid(cid)) and the_client._get_eventloop() is not asyncio.get_running_loop():
+            # The client is served by the loop (and the port) it was assigned to, see `App.loop_threads`. A websocket
+            # cannot be moved to another event loop, so it is closed, with the right url in the reason.
+            log_websocket_event('client served by another loop, closing', new_websocket, cid=cid, client=the_client)
+            await new_websocket.close(1008, f'wrong port, use {the_client.url}')
+        elif the_client:
             log_websocket_event('client found, passing websocket', new_websocket, cid=cid, client=the_client)
 
             # All client messaging happens here
@@ -128,18 +345,15 @@ class App_SrvThrItf(abc.ABC):
             # no problem. If a regular callback would be strated now it still would be processed to the end, and the
             # answer will be attempted to be sent, and will try to land in `the_client._outqueue`.
             #
-            # There is maybe a brief moment between connection breakdown and full cleaning of the
-            # `the_client.__pending_websocket_tasks` when new data can land on the `the_client._outqueue` and after all
+            # There is maybe a brief moment between connection breakdown and the cancelling of the reader and writer
+            # tasks when new data can land on the `the_client._outqueue` and after all
             # some data can be there from before the connection breakdown. That's why it is cleaned here. Before `await`
-            # above returns the `the_client._healthy_connection` is set to `False` and this coro executes as a single
-            # block to the end. All new `the_client.__put_on_outqueue` will be run after that, so they will see
-            # `the_client._healthy_connection == False` and the dropped messages are logged there.
+            # above returns the `the_client._healthy_connection` is set to `False`. All `the_client._send` calls after
+            # that see `the_client._healthy_connection == False` and the dropped messages are logged there.
             #
             # Finally, the sheduling of callbacks in `Client` will see `the_client._healthy_connection == False` and
             # further calls to callbacks will be dropped altogether in `CallbackTask.run()`.
-            while not the_client._outqueue.empty():
-                data = the_client._outqueue.get_nowait()
-                log_websocket_event('cancelling data send', client=the_client, data=data)
+            the_client._cancel_outqueue()
             log_websocket_event('client done with websocket', new_websocket, client=the_client)
         else:
             # no such client!
@@ -201,8 +415,27 @@ class App_SrvThrItf(abc.ABC):
 class Client_SrvThrItf(abc.ABC):
 
     def __init__(self):
-        self.__pending_websocket_tasks = set()
-        self._outqueue: asyncio.Queue = None
+        app = self._app_wr()
+        # The outgoing queue is shared by the sending threads and the writer task, so it is guarded by a condition. The
+        # items are tuples `(data, notification)`.
+        self._outqueue = collections.deque()
+        self._outqueue_cond = threading.Condition()
+        self.__outqueue_limit = app._outqueue_limit
+        self.__outqueue_policy = app._outqueue_policy
+        self.__outqueue_ready: asyncio.Event = None
+        # Is the `self.__wake_writer` already sheduled in the event loop? It is shedulled once for any number of
+        # messages put on the queue in the meantime.
+        self.__wakeup_pending = False
+        # The number of `ChunkedMessage`s taken from the queue by the writer and not sent whole yet
+        self.__streams_in_flight = 0
+        self.__outqueue_stats = {'depth': 0, 'peak_depth': 0, 'queued': 0, 'dropped': 0, 'blocked': 0}
+        self.__bundle = True
+        self.__flush_delay = 0.0
+        self.__parse_once = False
+        self.__max_bundle_size = 0
+        # Ids of the outgoing chunked messages, and the pieces of the incoming ones by their ids (server thread only)
+        self.__chunk_ids = itertools.count(1)
+        self.__incoming_chunks = {}
         evl = self._get_eventloop()
         self._pyside_ready = evl.create_future()
         evl.call_soon_threadsafe(self.__init_srvthr)
@@ -215,180 +448,248 @@ class Client_SrvThrItf(abc.ABC):
         to issue CRRCAN protocol messages, even if those messages won't hit the JS-side yet (because the connection with
         the browser is lagging behind.)
         """
-        self._outqueue = asyncio.Queue()
+        self.__outqueue_ready = asyncio.Event()
         self._pyside_ready.set_result(None)
         log_server_event('client pyside ready', client=self)
 
-    def __add_websocket_task(self, name, *, websocket=None, data=None):
-        """ Helper method for cleaner creating of the event loop tasks
-
-        """
-        if name == _WSTT.recieve_data:
-            coro = websocket.recv()
-        elif name == _WSTT.consume_outqueue:
-            coro = self.__consume_outqueue()
-        elif name == _WSTT.send_data:
-            if data is None:
-                return
-            coro = websocket.send(data)
-        else:
-            raise ValueError(f'No such websocket task `{name!r}`')
-        self.__pending_websocket_tasks.add(asyncio.create_task(coro, name=name))
-
     async def _websocket_communication(self, websocket):
         """ Main loop of the client communication
 
-        The tasks required for communication are kept in `self.__pending_websocket_tasks`. Approprietly to the state of
-        data queues task are created, consumed and resheduled. The results of this process in the rawest form possible
-        is then processed by appropriate methods of other `*_SrvThrItf` classes. All further processing of this data is
-        made in the non-abstract counerparts of the `*_SrvThrItf` classes in the main thread.
+        The communication is done by two tasks: the reader, which receives the messages from the websocket, and the
+        writer, which sends the messages from the outgoing queue one by one, in order. The results of this process in
+        the rawest form possible are then processed by appropriate methods of other `*_SrvThrItf` classes. All further
+        processing of this data is made in the non-abstract counerparts of the `*_SrvThrItf` classes in the main thread.
+
+        Both tasks loop until the connection breaks, so the first of them to finish ends this coro.
 
         """
         log_websocket_event('entering client websocket request body', client=self)
-        # Two tasks are added to the pending list: one to listen to incoming transmissions, and one to monitor the
-        # outgoing data queue. If the outgoing data queue is non-empty it is futher translated into separate sending
-        # tasks.
-        self.__add_websocket_task(_WSTT.recieve_data, websocket=websocket)
-        self.__add_websocket_task(_WSTT.consume_outqueue)
-        log_websocket_event('websocket task pool initiated', client=self, out_queue_size=self._outqueue.qsize())
+        app = self._app_wr()
+        self.__bundle = app._bundle
+        self.__flush_delay = app._flush_delay
+        self.__max_bundle_size = app._fragment_size
+        self.__parse_once = app._parse_once
+        tasks = {
+            asyncio.create_task(self.__reader(websocket), name=_WSTT.recieve_data),
+            asyncio.create_task(self.__writer(websocket), name=_WSTT.send_data),
+        }
+        log_websocket_event('websocket tasks created', client=self, out_queue_size=len(self._outqueue))
 
         exit_exception = exceptions.UnknownConnectionError()
-
-        while self.__pending_websocket_tasks:
-            log_websocket_event('websocket going to sleep', client=self)
-
-            # Here we wait for one on more tasks to be done. The tasks can be one of: data received, data to be send,
-            # and output queue non-empty. Each task can have normal result, be cancelled or raise an exception.
-            # Exceptions are always caused by some outside event - connection breakdown etc. Cancellation is done
-            # internally when this coro is finished.
-            (done, self.__pending_websocket_tasks) = await asyncio.wait(
-                self.__pending_websocket_tasks,
-                return_when=asyncio.FIRST_COMPLETED,
-                )
-
-            log_websocket_event(
-                'websocket awake',
-                client=self,
-                done_task_count=len(done),
-                pending_count=len(self.__pending_websocket_tasks),
-                out_queue_size=self._outqueue.qsize()
-            )
-            # There may be more than one taks done, they are processed in sequence
-            while done:
-                task: asyncio.Task = done.pop()
-                # The state of the task is gathered
-                task_name = task.get_name()
-                cancelled = task.cancelled()
-                exception = None
-                if not cancelled:
-                    exception = task.exception()
-                log_websocket_event(f'[task] `{task_name}`', client=self, cancelled=cancelled, exception=exception)
-                # If the task is being cancelled nothing is done
-                if cancelled:
-                    continue
-
-                # All exceptions in tasks end this coro, however the received exception is sometimes translated to some
-                # bengin exception, like `exceptions.ClientClosedNormally`.
-                if exception:
-                    # From now on, the connection is not healthy - this changes the way CRRCAN protocol operates: new
-                    # callbacks are not run; already running callbacks are finished, but their outgoing answer is
-                    # supressed, waiting notifications are run normally. The Py-side will fake some incoming
-                    # communications to finish running CRRCAN exchanges and unblock mutexed `Client`.
-                    self._healthy_connection = False
-                    # Preparing to finish this coro - all pending tasks are cancelled.
-                    for task in self.__pending_websocket_tasks:
-                        sucess = task.cancel()
-                        log_websocket_event(f'       `{task_name}`: canceling task', client=self, task_name=task.get_name(), sucess=sucess)
-                    # Normal closing of the websocket on the JS-side
-                    if isinstance(exception, websockets.exceptions.ConnectionClosedOK):
-                        if exception.reason == '*last*':
-                            # This exception was caused by explicit command `*last*` send from the Py-side. However,
-                            # the response to this command cannot be send normally (because the very reason of this
-                            # exception is that the websocket was closed.) The response is faked here, as a normall
-                            # (non-exceptional) response. The `exit_exception` will be passed to results of any other
-                            # waiting commands.
-                            data = f'[{_CrrcanMode.res},{self.command._last_ccid},0,{{"result":{self.command._last_ccid}}}]'
-                            exit_exception = exceptions.ClientClosedNormally()
-                        else:
-                            # This notification is needed to assure last run of `Client.run_one_callback_blocking()` The
-                            # notification itself does nothing - it only unblocks the main thread. The notofication has
-                            # also "faked" `ccid==-1` to avoid any collisions with real ccids which are bookkept by the
-                            # JS-side. The `exit_exception` will be passed to results of any waiting commands.
-                            # TODO: what if this occurs during `*last*`?
-                            data = f'[{_CrrcanMode.ntf},-1,"*close*",{{"kwargs":{{"code":{exception.code}}}}}]'
-                            exit_exception = exceptions.ClientClosedUnexpectedly()
-                    else:
-                        # TODO: what if this occurs during `*last*`?
-                        # The `exit_exception` is the default `UnknownConnectionError`.
-                        log_websocket_event(f'       `{task_name}`: UNKNOWN EXCEPTION IN TASK', client=self, exception=exception)
-                        # TODO: this is the only notfication so far, that has non-`int` noun - maybe it should be `-1`?
-                        data = f'[{_CrrcanMode.ntf},-1,"*close*",{{"kwargs":{{"exc":{repr(exception)!r}}}}}]'
-                    # The fake response or notification is processsed in the main thread, this should ALWAYS be
-                    # propperly formated CRRCAN messages, because they are constructed right here, above. Therefore the
-                    # `BadCRRCANMessageError` exception is not catched.
-                    self.__crrcan_switchboard(data, task_name)
-                    continue
-
-                # Normal operation of the tasks
-                if task_name == _WSTT.consume_outqueue:
-                    # One or more outgoing data to send was found on the queue
-                    data_list = task.result()
-                    log_websocket_event(f'       `{task_name}`', client=self, msg_count=len(data_list))
-                    for data in data_list:
-                        # Translate each data taken from the outgoing queue into a sending task
-                        self.__add_websocket_task(_WSTT.send_data, websocket=websocket, data=data)
-                    # Recreate the outgoing queue consuming task
-                    self.__add_websocket_task(_WSTT.consume_outqueue)
-
-                elif task_name == _WSTT.send_data:
-                    # Data was sent, nothing really to do.
-                    pass
-
-                elif task_name == _WSTT.recieve_data:
-                    # Data received throug the websocket, passed for processing in the main thread.
-                    self.__add_websocket_task(_WSTT.recieve_data, websocket=websocket)
-                    data = task.result()
-                    try:
-                        self.__crrcan_switchboard(data, task_name)
-                    except BadCRRCANMessageError as excp:
-                        # TODO: This really should schedule some kind of error callback?
-                        log_websocket_event(f'       `{task_name}`: BAD CRRCAN MESSAGE, {excp.reason}', client=self, data=data)
+        try:
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # From now on, the connection is not healthy - this changes the way CRRCAN protocol operates: new callbacks
+            # are not run; already running callbacks are finished, but their outgoing answer is supressed, waiting
+            # notifications are run normally. The Py-side will fake some incoming communications to finish running
+            # CRRCAN exchanges and unblock mutexed `Client`.
+            self._healthy_connection = False
+            for task in tasks:
+                sucess = task.cancel()
+                log_websocket_event(f'canceling task', client=self, task_name=task.get_name(), sucess=sucess)
+
+        # If both tasks are done, the reader knows better why the connection was closed
+        task = min(done, key=lambda task: task.get_name() != _WSTT.recieve_data)
+        task_name = task.get_name()
+        exception = task.exception()
+        log_websocket_event(f'[task] `{task_name}`', client=self, exception=exception)
+
+        # All exceptions in tasks end this coro, however the received exception is sometimes translated to some bengin
+        # exception, like `exceptions.ClientClosedNormally`.
+        if isinstance(exception, websockets.exceptions.ConnectionClosedOK):
+            # Normal closing of the websocket on the JS-side
+            if exception.reason == '*last*':
+                # This exception was caused by explicit command `*last*` send from the Py-side. However, the response
+                # to this command cannot be send normally (because the very reason of this exception is that the
+                # websocket was closed.) The response is faked here, as a normall (non-exceptional) response. The
+                # `exit_exception` will be passed to results of any other waiting commands.
+                data = f'[{_CrrcanMode.res},{self.command._last_ccid},0,{{"result":{self.command._last_ccid}}}]'
+                exit_exception = exceptions.ClientClosedNormally()
+            else:
+                # This notification is needed to assure last run of `Client.run_one_callback_blocking()` The
+                # notification itself does nothing - it only unblocks the main thread. The notofication has also
+                # "faked" `ccid==-1` to avoid any collisions with real ccids which are bookkept by the JS-side. The
+                # `exit_exception` will be passed to results of any waiting commands.
+                # TODO: what if this occurs during `*last*`?
+                data = f'[{_CrrcanMode.ntf},-1,"*close*",{{"kwargs":{{"code":{exception.code}}}}}]'
+                exit_exception = exceptions.ClientClosedUnexpectedly()
+        else:
+            # TODO: what if this occurs during `*last*`?
+            # The `exit_exception` is the default `UnknownConnectionError`.
+            log_websocket_event(f'       `{task_name}`: UNKNOWN EXCEPTION IN TASK', client=self, exception=exception)
+            # TODO: this is the only notfication so far, that has non-`int` noun - maybe it should be `-1`?
+            data = f'[{_CrrcanMode.ntf},-1,"*close*",{{"kwargs":{{"exc":{repr(exception)!r}}}}}]'
+        # The fake response or notification is processsed in the main thread, this should ALWAYS be propperly formated
+        # CRRCAN messages, because they are constructed right here, above. Therefore the `BadCRRCANMessageError`
+        # exception is not catched.
+        self.__crrcan_switchboard(data, task_name)
 
         log_websocket_event('exiting client websocket request body', client=self, exit_exc=exit_exception)
         return exit_exception
 
+    async def __reader(self, websocket):
+        """ Receives the messages until the connection breaks
+
+        Each message is passed for processing in the main thread.
+        """
+        while True:
+            data = await websocket.recv()
+            try:
+                self.__crrcan_switchboard(data, _WSTT.recieve_data)
+            except BadCRRCANMessageError as excp:
+                # TODO: This really should schedule some kind of error callback?
+                log_websocket_event(f'       `{_WSTT.recieve_data}`: BAD CRRCAN MESSAGE, {excp.reason}', client=self, data=data)
+
+    async def __writer(self, websocket):
+        """ Sends the messages from the outgoing queue until the connection breaks
+
+        This is the only coro sending through the websocket, so the messages are sent strictly in the order they were
+        put on the queue. A sending of a message is finished before the next one is started. The exception are the
+        chunked messages (`ChunkedMessage`): after each batch of other messages one chunk of each of them is sent, so
+        the messages put on the queue after a long message can overtake it.
+        """
+        streams = collections.deque()
+        while True:
+            # One or more outgoing data to send is taken from the queue, it is not waited for if chunks are waiting
+            data_list = await self.__consume_outqueue(wait=not any(streams))
+            if data_list:
+                log_websocket_event(f'       `{_WSTT.send_data}`', client=self, msg_count=len(data_list))
+                if streams or any(type(data) is ChunkedMessage for data in data_list):
+                    for data in data_list:
+                        if type(data) is ChunkedMessage:
+                            streams.append(data)
+                    data_list = [data for data in data_list if type(data) is not ChunkedMessage]
+                if self.__bundle and len(data_list) > 1:
+                    # The batch is coalesced into as few websocket messages as possible
+                    data_list = bundle_crrcan_messages(data_list, self.__max_bundle_size)
+                for data in data_list:
+                    if not isinstance(data, (str, bytes)):
+                        # A list of chunks of a long message -- it is sent as a fragmented websocket message
+                        data = self.__iterate_fragments(data)
+                    await websocket.send(data)
+            for _ in range(len(streams)):
+                stream = streams.popleft()
+                with self._outqueue_cond:
+                    chunk = stream.popleft() if stream else None
+                    finished = stream.done and not stream
+                    if finished:
+                        self.__streams_in_flight -= 1
+                    if chunk is not None or finished:
+                        # The threads may wait for the room for next chunks, or on the full queue
+                        self._outqueue_cond.notify_all()
+                if chunk is not None:
+                    await websocket.send(chunk)
+                if not finished:
+                    streams.append(stream)
+            if any(streams):
+                # Other tasks (and other clients) are not starved by a long message
+                await asyncio.sleep(0)
+
+    @staticmethod
+    async def __iterate_fragments(chunks):
+        """ Asynchronous iterator of fragments of a long message
+
+        The chunks are already encoded (in the thread which sent the message). The control is given back to the event
+        loop after each fragment, so a long message does not starve other tasks (and other clients).
+        """
+        for chunk in chunks:
+            yield chunk
+            await asyncio.sleep(0)
+
     def __crrcan_switchboard(self, data, task_name):
         """ Passing raw data to main thread
 
         The raw data are "peeked" with regular expressions to extract control values of the CRRCAN protocol. On the
         basis of these values apropriate action is sheduled to be done in the main thread. No additional data parsing is
         done here - it is all deferred until the appropriate action is taken in the main thread.
+
+        Binary framed messages (`bytes`, see the `binary_framing` feature) carry the control values in a fixed binary
+        header, which is just unpacked.
+
+        With the `parse_once` option of the `App` the JSON of the message is parsed here instead, and the
+        `ParsedMessage` is passed to the main thread. Its payload is still decoded there (e.g. the `RemoteObj`s are
+        created there). If the parsing fails, the raw data is passed as usual, so the error is raised in the main
+        thread. The messages of a bundle are always passed as `ParsedMessage`s.
         """
         log_websocket_event(f'       `{task_name}`: crrcan', client=self, data=data)
-        if match_mode_ccid := re_crrcan_start.match(data):
+        msg = None
+        offset = None
+        if type(data) is ParsedMessage:
+            msg = data
+        elif self.__parse_once and not _is_chunk(data):
+            try:
+                msg = parse_crrcan_message(data)
+            except (ValueError, struct.error, BadCRRCANMessageError) as excp:
+                log_websocket_event(f'       `{task_name}`: parsing failed', client=self, exception=excp)
+        if msg is not None:
+            data = msg
+            mode, ccid, noun, _ = msg
+            match_mode_ccid = None
+        elif isinstance(data, bytes):
+            try:
+                mode, ccid, noun, offset = unpack_crrcan_header(data)
+            except (struct.error, UnicodeDecodeError):
+                raise BadCRRCANMessageError('bad binary message header')
+            match_mode_ccid = None
+        elif match_mode_ccid := re_crrcan_start.match(data):
             mode, ccid = map(int, match_mode_ccid.groups())
-            log_websocket_event(f'       `{task_name}`: crrcan', client=self, mode=mode, ccid=ccid)
-            if mode == _CrrcanMode.res:
-                # The noun is not parsed here, because it contains the status of the response (normal/exception) and
-                # this will be delt with in the `Command.result`.
-                self.command.set_resolved_mupf(ccid, data)
-            elif mode == _CrrcanMode.clb or mode == _CrrcanMode.ntf:
+            noun = None
+        else:
+            raise BadCRRCANMessageError('bad message start format (`[<mode>,<ccid>,...`)')
+        log_websocket_event(f'       `{task_name}`: crrcan', client=self, mode=mode, ccid=ccid)
+        if mode == _CrrcanMode.bdl:
+            # A bundle (e.g. the responses to a group of commands) is split, and each message is processed as if it
+            # was received alone
+            try:
+                messages = msg[3] if msg is not None else json.loads(data)[3]
+                messages = [ParsedMessage(message) for message in messages]
+            except (ValueError, IndexError, TypeError):
+                raise BadCRRCANMessageError('bad bundle message')
+            if any(len(message) != 4 for message in messages):
+                raise BadCRRCANMessageError('bad message in a bundle')
+            for message in messages:
+                self.__crrcan_switchboard(message, task_name)
+        elif mode == _CrrcanMode.chk:
+            # A piece of a long message. The message is processed (e.g. a response is resolved) when its last piece
+            # comes, and the pieces of different messages can be interleaved.
+            if msg is not None:
+                _, _, more, piece = msg
+            elif offset is not None:
+                more, piece = noun, data[offset:]
+            else:
+                try:
+                    _, _, more, piece = json.loads(data)
+                except (ValueError, TypeError):
+                    raise BadCRRCANMessageError('bad chunk message')
+            if more < 0:
+                # The message is abandoned by the sender
+                self.__incoming_chunks.pop(ccid, None)
+                return
+            pieces = self.__incoming_chunks.setdefault(ccid, [])
+            pieces.append(piece)
+            if not more:
+                del self.__incoming_chunks[ccid]
+                self.__crrcan_switchboard(pieces[0][:0].join(pieces), task_name)
+        elif mode == _CrrcanMode.res:
+            # The noun is not parsed here, because it contains the status of the response (normal/exception) and
+            # this will be delt with in the `Command.result`.
+            self.command.set_resolved_mupf(ccid, data)
+        elif mode == _CrrcanMode.clb or mode == _CrrcanMode.ntf:
+            if match_mode_ccid is not None:
                 if match_noun := re_crrcan_noun.match(data, match_mode_ccid.span()[1]):
                     noun = match_noun.group(1)
                     noun = self.__unesc_str(noun) if noun.startswith('"') else int(noun)
-                    # Now we know noun (which points directly to the callback function), so we can differentiate how
-                    # the calback will be run on the basis of the callback itself.
-                    self._callback_queue.put(_remote.CallbackTask(self, mode, ccid, noun, data))
-                    # TODO: reconsider if maybe only the payload should be passed unprocessed, and all control
-                    # values obtained here should be passed and not re-parsed again from raw data.
                 else:
                     # TODO: reconsider usage of `str` as noun. It is now only used for `"*close*"` fake
                     # notification, which already has a fake ccid. Is there another valid usage of `str` nouns?
                     raise BadCRRCANMessageError("illegal noun for `clb` or `ntf` message (must be `int` or `str`)")
-            else:
-                raise BadCRRCANMessageError(f'unknown mode={mode!r}')
+            # Now we know noun (which points directly to the callback function), so we can differentiate how
+            # the calback will be run on the basis of the callback itself.
+            self._callback_queue.put(_remote.CallbackTask(self, mode, ccid, noun, data))
+            # TODO: reconsider if maybe only the payload should be passed unprocessed, and all control
+            # values obtained here should be passed and not re-parsed again from raw data.
         else:
-            raise BadCRRCANMessageError('bad message start format (`[<mode>,<ccid>,...`)')
+            raise BadCRRCANMessageError(f'unknown mode={mode!r}')
 
     @staticmethod
     def __unesc_str(s: str) -> str:
@@ -396,33 +697,155 @@ class Client_SrvThrItf(abc.ABC):
         """
         return s[1:-1].encode('utf-8').decode('unicode_escape')
 
-    async def __consume_outqueue(self):
+    async def __consume_outqueue(self, wait=True):
         """ Empty the outgoing queue
 
-        This coro waits for at least one message on the outgoing queue, but if there is more, it takes them all.
+        This coro waits for at least one message on the outgoing queue, but if there is more, it takes them all. With a
+        non-zero `flush_delay` of the `App` it waits that long after the first message, so a burst of messages (e.g. a
+        tight loop of `.run()` notifications) is taken as one batch. With `wait=False` it returns at once, possibly
+        with no messages. It also returns with no messages when a new chunk of a message being encoded is put (see
+        `_send_chunked`).
 
         """
-        result = []
-        result.append(await self._outqueue.get())
-        while not self._outqueue.empty():
-            result.append(self._outqueue.get_nowait())
+        with self._outqueue_cond:
+            idle = not self._outqueue
+            if idle:
+                if not wait:
+                    return []
+                self.__outqueue_ready.clear()
+        if idle:
+            await self.__outqueue_ready.wait()
+        if wait and self.__flush_delay and self._outqueue:
+            await asyncio.sleep(self.__flush_delay)
+        with self._outqueue_cond:
+            result = [data for data, _ in self._outqueue]
+            self._outqueue.clear()
+            self.__streams_in_flight += sum(type(data) is ChunkedMessage for data in result)
+            self._outqueue_cond.notify_all()
         return result
 
-    def _send(self, data: bytes):
+    def _send_chunked(self, pieces, *, notification=False, bounded=False):
+        """ Puts a long message, encoded in `pieces`, on the outgoing queue as chunks, see `ChunkedMessage`
+
+        The `pieces` can be a generator encoding the message, the chunks are put as the pieces come. With `bounded` at
+        most `_CHUNK_STREAM_DEPTH` chunks wait for sending -- the sending thread waits for the writer, so only a part of
+        the message is held in memory at a time (in the thread of the event loop it never waits, it would wait for
+        itself). If the encoding fails, the message is abandoned: a chunk with `more` of `-1` is sent, so the receiving
+        side drops the pieces it got, and the exception is raised.
+        """
+        stream = ChunkedMessage()
+        stream_id = next(self.__chunk_ids)
+        Client_SrvThrItf._send(self, stream, notification=notification)
+        depth = _CHUNK_STREAM_DEPTH if bounded and not self._in_eventloop_thread() else None
+        pieces = iter(pieces)
+        try:
+            piece = next(pieces)
+            for next_piece in pieces:
+                if not self.__put_chunk(stream, _chunk(piece, stream_id, 1), depth):
+                    return
+                piece = next_piece
+        except BaseException:
+            self.__put_chunk(stream, _chunk('', stream_id, -1), None, done=True)
+            raise
+        self.__put_chunk(stream, _chunk(piece, stream_id, 0), depth, done=True)
+
+    def __put_chunk(self, stream, chunk, depth, done=False):
+        """ Puts the next chunk of a `ChunkedMessage` being sent, returns `False` if the connection is broken
+        """
+        with self._outqueue_cond:
+            if depth is not None:
+                self._outqueue_cond.wait_for(lambda: len(stream) < depth or not self._healthy_connection)
+            if not self._healthy_connection:
+                log_websocket_event(f'data dropped from sending', client=self, data=chunk)
+                return False
+            stream.append(chunk)
+            stream.done = done
+            # The writer waits for new data only if no chunks are ready
+            if len(stream) > 1 or self.__wakeup_pending:
+                return True
+            self.__wakeup_pending = True
+        self._get_eventloop().call_soon_threadsafe(self.__wake_writer)
+        return True
+
+    def _in_eventloop_thread(self):
+        try:
+            return asyncio.get_running_loop() is self._get_eventloop()
+        except RuntimeError:
+            return False
+
+    def _send(self, data, *, notification=False):
         """ Puts data to send on the outgoing queue
 
-        The data is put thread-safe on the `asyncio.Queue`, so any number of messages can be sent even if the connection
-        is not established or halted for some reason. The data from the queue is processed by `self.__consume_outqueue`
-        coro. The data is put on the queue through `self.__put_on_outqueue`.
+        The data is put thread-safe on the queue, so messages can be sent even if the connection is not established or
+        halted for some reason. The data from the queue is processed by `self.__consume_outqueue` coro, which is woken up
+        through `self.__outqueue_ready` event. Waking up the event loop from other thread is costly, so it is done only
+        if it is not already pending -- all messages sent before the loop gets to it cost a single wake-up.
+
+        If the `App` has an `outqueue_limit` and the queue is full, the `outqueue_policy` of the `App` is applied.
+        Notifications (`notification=True`) are the only messages which can be dropped. The long messages taken from the
+        queue by the writer, but not sent whole yet (see `ChunkedMessage`), still count as messages on the queue. The
+        thread of the event loop is never blocked (the queue would never be emptied), the message is queued over the
+        limit there.
 
         """
-        self._get_eventloop().call_soon_threadsafe(self.__put_on_outqueue, data)
+        with self._outqueue_cond:
+            stats = self.__outqueue_stats
+            limit = self.__outqueue_limit
+            if limit is not None and self.__queued() >= limit and self._healthy_connection:
+                if self.__outqueue_policy is OutqueuePolicy.error:
+                    raise exceptions.OutqueueFullError(f'outgoing queue of {self!r} is full ({limit} messages)')
+                if self.__outqueue_policy is OutqueuePolicy.drop_notifications:
+                    for i, (_, ntf) in enumerate(self._outqueue):
+                        if ntf:
+                            dropped_data, _ = self._outqueue[i]
+                            del self._outqueue[i]
+                            stats['dropped'] += 1
+                            log_websocket_event(f'notification dropped from full queue', client=self, data=dropped_data)
+                            break
+                if self.__queued() >= limit and self._in_eventloop_thread():
+                    log_websocket_event(f'data queued over the limit in the event loop', client=self, data=data)
+                elif self.__queued() >= limit:
+                    stats['blocked'] += 1
+                    self._outqueue_cond.wait_for(
+                        lambda: self.__queued() < limit or not self._healthy_connection
+                    )
+            if not self._healthy_connection:
+                log_websocket_event(f'data dropped from sending', client=self, data=data)
+                return
+            self._outqueue.append((data, notification))
+            stats['queued'] += 1
+            stats['peak_depth'] = max(stats['peak_depth'], len(self._outqueue))
+            if self.__wakeup_pending:
+                return
+            self.__wakeup_pending = True
+        self._get_eventloop().call_soon_threadsafe(self.__wake_writer)
 
-    def __put_on_outqueue(self, data):
-        if self._healthy_connection:
-            self._outqueue.put_nowait(data)
-        else:
-            log_websocket_event(f'data dropped from sending', client=self, data=data)
+    def __queued(self):
+        return len(self._outqueue) + self.__streams_in_flight
+
+    def __wake_writer(self):
+        # The flag is cleared first, so a message put on the queue after that sheddules a new wake-up
+        with self._outqueue_cond:
+            self.__wakeup_pending = False
+        self.__outqueue_ready.set()
+
+    def _cancel_outqueue(self):
+        """ Drops all data waiting on the outgoing queue
+
+        It is called when the connection is already broken. The threads blocked on the full queue are woken up.
+        """
+        with self._outqueue_cond:
+            while self._outqueue:
+                data, _ = self._outqueue.popleft()
+                log_websocket_event('cancelling data send', client=self, data=data)
+            self.__streams_in_flight = 0
+            self._outqueue_cond.notify_all()
+
+    def _get_outqueue_stats(self):
+        with self._outqueue_cond:
+            stats = dict(self.__outqueue_stats)
+            stats['depth'] = len(self._outqueue)
+        return stats
 
     @abc.abstractmethod
     def _get_eventloop(self) -> asyncio.AbstractEventLoop:
@@ -433,33 +856,70 @@ class MetaCommand_SrvThrItf:
 
     def __init__(cls):
         cls._global_mutex = threading.RLock()
-        """ This global mutex is required to read and alter `_unresolved` """
-        cls._ccid_counter = 1
-        # TODO: Does the counter need to be protected by th mutex?
+        """ This global mutex guards the resolution of commands (not the `_unresolved` itself) """
+        cls._resolved_cond = threading.Condition(cls._global_mutex)
+        """ Notified when any command is resolved, the threads waiting for results of the client wait on it """
+        cls._ccids = itertools.count(1)
+        """ The source of ccids -- `next()` of it is atomic, so it is used without a lock """
         cls._unresolved = {}
+        """ Commands waiting for a response by ccid. Commands are added (without a lock) by the issuing threads, and
+        removed by the server thread. """
+        cls._cancelled = set()
+        """ Ccids of commands resolved before their responses came (e.g. timed out), their late responses are dropped.
+        The JS-side answers each cancelled command exactly once (with an empty response if it does not run it), so a
+        ccid is removed when its response comes. """
 
     def set_resolved_mupf(cls, ccid, raw_data):
-        """ Put raw result data on the command object and unlock its mutex
+        """ Put raw result data on the command object and wake up the threads waiting for it
+
+        The `_unresolved` is the completion table of the client -- the command is found there by its ccid. There are no
+        per-command locks or events, all waiting threads of the client share the `_resolved_cond`.
         """
-        with cls._global_mutex:
-            if ccid in cls._unresolved:
-                log_websocket_event('resolving', ccid=ccid, raw=raw_data)
-                cmd = cls._unresolved[ccid]
+        if (cmd := cls._unresolved.pop(ccid, None)) is not None:
+            log_websocket_event('resolving', ccid=ccid, raw=raw_data)
+            with cls._global_mutex:
                 cmd._raw_result = raw_data
-                cmd._is_resolved.set()
-                del cls._unresolved[ccid]
-            else:
-                raise RuntimeError(f'Response data `{raw_data!r}` from client, with no ccid={ccid} command waiting for resolution')
+                cmd._is_resolved = True
+                cls._resolved_cond.notify_all()
+            cmd._notify_awaiting()
+        elif ccid in cls._cancelled:
+            cls._cancelled.discard(ccid)
+            log_websocket_event('dropping late response', ccid=ccid, raw=raw_data)
+        else:
+            raise RuntimeError(f'Response data `{raw_data!r}` from client, with no ccid={ccid} command waiting for resolution')
+
+    def set_cancelled_mupf(cls, cmd, exc):
+        """ Resolve a command with `exc` without waiting for its response any longer
+
+        Returns `False` if the response of the command came in the meantime. The command is removed from the completion
+        table, and its response is dropped if it comes later.
+        """
+        # The ccid is marked before the command is popped, so the server thread cannot see it neither waiting nor
+        # cancelled
+        cls._cancelled.add(cmd._ccid)
+        if cls._unresolved.pop(cmd._ccid, None) is None:
+            cls._cancelled.discard(cmd._ccid)
+            return False
+        log_websocket_event('cancelling', ccid=cmd._ccid, exc=exc)
+        with cls._global_mutex:
+            cmd._resolve(exc)
+            cmd._is_resolved = True
+            cls._resolved_cond.notify_all()
+        cmd._notify_awaiting()
+        return True
 
     def set_all_resolved_with_exception_mupf(cls, exc):
+        cls._cancelled.clear()
         unresolved = []
+        while cls._unresolved:
+            unresolved.append(cls._unresolved.popitem()[1])
         with cls._global_mutex:
-            for ccid, cmd in cls._unresolved.items():
+            for cmd in unresolved:
                 cmd._resolve(exc)
-                unresolved.append(cmd)
-            cls._unresolved.clear()
+                cmd._is_resolved = True
+            cls._resolved_cond.notify_all()
         for cmd in unresolved:
-            cmd._is_resolved.set()
+            cmd._notify_awaiting()
             log_websocket_event(f'resolving command with exception', cmd=cmd, cls=cls, exc=exc)
 
 @loggable('app.py/websocket_event', log_exit=False)
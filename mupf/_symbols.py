@@ -23,6 +23,7 @@ this = _Symbol("_this", readonly=True)
 rid = _Symbol("_rid", readonly=True)
 client = _Symbol("_client", readonly=True, weakref=True)
 command = _Symbol("_command", readonly=True, weakref=True)
+aio = _Symbol("_aio", readonly=True)
 
 def __getattr__(name: str) -> _Symbol:
     return _Symbol('_'+name)
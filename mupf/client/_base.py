@@ -1,5 +1,7 @@
+import itertools
 import json
 import queue
+import threading
 import weakref
 
 import mupf.exceptions as exceptions
@@ -14,7 +16,7 @@ from ..log import loggable, LogManager
 
 from . import _crrcan
 
-from .._srvthr import Client_SrvThrItf
+from .._srvthr import Client_SrvThrItf, _CrrcanMode, ParsedMessage, pack_crrcan_header, unpack_crrcan_header
 
 
 @loggable(
@@ -35,23 +37,32 @@ class Client(Client_SrvThrItf):
     def __init__(self, app, client_id):
         self._app_wr = weakref.ref(app)
         self._cid = client_id
+        # The index of the event loop (and the server thread) of the app serving the client, the least busy one
+        loads = [0] * app._loop_threads
+        for other in app._clients_by_cid.values():
+            loads[other._loop_index] += 1
+        self._loop_index = loads.index(min(loads))
         app._clients_by_cid[client_id] = self
 
         self._user_agent = None
         self.features = set()
         self.enhjson_decoders = {
             "@": self.get_remote_obj,
+            "B": enhjson.decode_buffer,
         }
         self._callback_queue = queue.Queue()
 
         self._healthy_connection = True    # FIXME: this should not start as True by default
         self.command = _command.create_command_class_for_client(self)
         """ A ``command`` class used in command invoking syntax. """
+        self.command._default_timeout = app._command_timeout
 
         self.window = RemoteObj(0, self)
         """ A :class:`~mupf._remote.RemoteObj` object representing the ``window`` object on the JS-side. """
 
         self._remote_obj_byid = weakref.WeakValueDictionary()
+        self._remote_obj_lock = threading.RLock()
+        self._decode_lock = threading.Lock()
         self._clbid_by_callbacks = {}
         self._callbacks_by_clbid = {}
         self._callback_free_id = 0
@@ -61,10 +72,99 @@ class Client(Client_SrvThrItf):
         self._get_callback_id(log_debug, '*close*')
 
     def _send(self, data):
+        """ Encodes and sends a CRRCAN message
+
+        A message that fits in a single chunk of `App` `chunk_size` is sent as is. A longer one is sent in chunk
+        messages, interleaved with other messages (see `ChunkedMessage`), or -- with no `chunk_size` -- as a fragmented
+        websocket message of `fragment_size` fragments. The whole message is always encoded here, in the calling
+        thread, so the escapes (e.g. callback ids) are resolved here, encoding errors are raised to the caller, and the
+        data may be freely mutated after the call. Only the sending of the chunks is left to the server thread. The
+        chunks are put on the queue as they are encoded, and the encoding waits while a few of them wait for sending,
+        so a long message is not held in memory as a whole. The exceptions are the escape-free messages, encoded at once
+        by the C encoder (see the fast path of `enhjson.iterencode`), and the fragmented messages.
+
+        With the `binary_framing` feature the message is sent as `bytes` -- a binary header followed by the payload only.
+        """
+        if F.core_features in self.features:
+            # In a group of commands each command has its own enhanced block
+            for msg in (data[3] if data[0] == _CrrcanMode.grp else (data,)):
+                msg[3] = enhjson.EnhancedBlock(
+                    msg[3],
+                    opt=enhjson.OptPolicy.addresses,
+                    refs=(F.shared_refs in self.features),
+                )
+        app = self._app_wr()
+        chunk_size = app._chunk_size or app._fragment_size
+        if F.binary_framing in self.features:
+            chunks = (
+                chunk.encode('utf-8')
+                for chunk in enhjson.iterencode(
+                    data[3], escape=self._escape_for_json, chunk_size=chunk_size, fast_path=True
+                )
+            )
+            first = pack_crrcan_header(*data[:3]) + next(chunks)
+        else:
+            chunks = enhjson.iterencode(data, escape=self._escape_for_json, chunk_size=chunk_size, fast_path=True)
+            first = next(chunks)
+        second = next(chunks, None)
+        notification = (data[0] == 2)
+        if second is None:
+            Client_SrvThrItf._send(self, first, notification=notification)
+        elif app._chunk_size:
+            self._send_chunked(itertools.chain((first, second), chunks), notification=notification, bounded=True)
+        else:
+            Client_SrvThrItf._send(self, [first, second, *chunks], notification=notification)
+
+    def _shared_encoding_key(self):
+        """ Clients with equal keys encode the payloads of messages the same way """
+        return (F.core_features in self.features, F.shared_refs in self.features, F.binary_framing in self.features)
+
+    def _encode_shared_payload(self, payload):
+        """ Encodes the payload of a message sent to many clients (see `App.broadcast()`)
+
+        Returns the chunks of the payload, which can be sent with `_send_shared()` by all clients with the same
+        `_shared_encoding_key()`, or `None` if the payload holds values encoded differently in each client.
+        """
         if F.core_features in self.features:
-            data[3] = enhjson.EnhancedBlock(data[3])
-        data = enhjson.encode(data, escape=self._escape_for_json)
-        Client_SrvThrItf._send(self, data)
+            payload = enhjson.EnhancedBlock(
+                payload,
+                opt=enhjson.OptPolicy.addresses,
+                refs=(F.shared_refs in self.features),
+            )
+        app = self._app_wr()
+        try:
+            chunks = list(enhjson.iterencode(
+                payload, escape=_escape_for_all_clients, chunk_size=(app._chunk_size or app._fragment_size),
+                fast_path=True,
+            ))
+        except _ClientSpecificValue:
+            return None
+        if F.binary_framing in self.features:
+            chunks = [chunk.encode('utf-8') for chunk in chunks]
+        return chunks
+
+    def _send_shared(self, mode, ccid, noun, chunks):
+        """ Sends a message with the payload encoded by `_encode_shared_payload()`
+
+        A payload of a single chunk is sent as a fragmented websocket message, the head of the message (different in
+        each client), the payload itself and the tail, so the payload is not copied and all clients send the same
+        object. The chunk messages of a longer payload are built in each client (their ids are different), from the
+        shared pieces.
+        """
+        if F.binary_framing in self.features:
+            head, tail = pack_crrcan_header(mode, ccid, noun), b''
+        else:
+            head, tail = f'[{mode},{ccid},{enhjson.encode(noun)},', ']'
+        notification = (mode == _CrrcanMode.run)
+        if len(chunks) == 1:
+            parts = [head, chunks[0], tail] if tail else [head, chunks[0]]
+            Client_SrvThrItf._send(self, parts, notification=notification)
+        else:
+            chunks = [head + chunks[0], *chunks[1:-1], chunks[-1] + tail]
+            if self._app_wr()._chunk_size:
+                self._send_chunked(chunks, notification=notification)
+            else:
+                Client_SrvThrItf._send(self, chunks, notification=notification)
 
     def _escape_for_json(self, value):
         """ Encoding advanced types for JSON transport
@@ -75,8 +175,11 @@ class Client(Client_SrvThrItf):
 
         We can here get a help from :func:`enhjson.test_element_type` function that will return a
         :class:`enhjson.JsonElement` enum member if it can.
+
+        Values of builtin types known to the `json` module must not be escaped here, because messages are encoded with
+        the fast path of :func:`enhjson.iterencode`.
         """
-        if isinstance(value, RemoteObj):
+        if type(value) is RemoteObj:    # `RemoteObj` is final, so it is enough to check the exact type
             return '@', value[S.rid]
         json_type = enhjson.test_element_type(value)
         if json_type == enhjson.JsonElement.Unknown:
@@ -95,7 +198,21 @@ class Client(Client_SrvThrItf):
 
     @loggable()
     def _decode_crrcan_msg(self, raw_json):
-        msg = json.loads(raw_json)
+        if type(raw_json) is ParsedMessage:
+            # Already parsed in the server thread. The payload is decoded in place, so it is done only once, even if
+            # many threads use the message (e.g. wait for the same command).
+            with self._decode_lock:
+                if raw_json.decoded is None:
+                    raw_json.decoded = self._decode_crrcan_payload(list(raw_json))
+                return raw_json.decoded
+        if isinstance(raw_json, bytes):
+            mode, ccid, noun, payload_start = unpack_crrcan_header(raw_json)
+            msg = [mode, ccid, noun, json.loads(raw_json[payload_start:])]
+        else:
+            msg = json.loads(raw_json)
+        return self._decode_crrcan_payload(msg)
+
+    def _decode_crrcan_payload(self, msg):
         if F.core_features in self.features:
             msg[3] = enhjson.decode_enhblock(msg[3], self.enhjson_decoders)
         if msg[0] == 1 and msg[2] != 0:
@@ -109,9 +226,10 @@ class Client(Client_SrvThrItf):
     def get_remote_obj(self, rid, ctxrid=None):
         if rid == 0:
             return self.window
-        if (rid, ctxrid) in self._remote_obj_byid:
-            return self._remote_obj_byid[(rid, ctxrid)]
-        else:
+        # The messages are decoded in many threads, and there must be only one `RemoteObj` for an object of the JS-side
+        with self._remote_obj_lock:
+            if (rem_obj := self._remote_obj_byid.get((rid, ctxrid))) is not None:
+                return rem_obj
             if ctxrid is None:
                 rem_obj = RemoteObj(rid, self, None)
             else:
@@ -209,13 +327,55 @@ class Client(Client_SrvThrItf):
     def cid(self):
         return self._cid
 
+    @property
+    @loggable('*.:', log_enter=False)
+    def outqueue_stats(self):
+        """ Statistics of the outgoing queue
+
+        A dict with the current `depth` of the queue, its `peak_depth`, and the counts of messages `queued`, `dropped`
+        (see `mupf.OutqueuePolicy`) and of the times a sending thread was `blocked` on the full queue.
+        """
+        return self._get_outqueue_stats()
+
+    @property
+    def command_timeout(self):
+        """ The default timeout (in seconds) of the commands of this client, `None` is no timeout
+
+        Waiting for the result of a command longer than that raises :class:`~mupf.exceptions.CommandTimeoutError`. It
+        applies to the commands issued after it is set. A single command can have its own timeout, see
+        ``Command.with_timeout()``.
+        """
+        return self.command._default_timeout
+
+    @command_timeout.setter
+    def command_timeout(self, value):
+        self.command._default_timeout = value
+
     @property
     @loggable('*.:', log_enter=False)
     def url(self):
-        return f"http://{self.app._host}:{self.app._port}/mupf/{self.cid}/"
+        return f"http://{self.app._host}:{self.app._port + self._loop_index}/mupf/{self.cid}/"
 
     def _get_eventloop(self):
-        return self._app_wr()._event_loop
+        return self._app_wr()._event_loops[self._loop_index]
+
+
+class _ClientSpecificValue(Exception):
+    pass
+
+def _escape_for_all_clients(value):
+    """ `Client._escape_for_json()` for the payloads encoded once for many clients
+
+    The values which would be escaped differently in each client raise `_ClientSpecificValue`.
+    """
+    if type(value) is RemoteObj:
+        raise _ClientSpecificValue()
+    json_type = enhjson.test_element_type(value)
+    if json_type == enhjson.JsonElement.Unknown:
+        if callable(value):
+            raise _ClientSpecificValue()
+        return enhjson.JsonElement.Autonomous
+    return json_type
 
 
 @loggable('client/base.py/debug')
@@ -36,6 +36,14 @@ class UnknownConnectionError(MupfError):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+class OutqueueFullError(MupfError):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+class CommandTimeoutError(MupfError):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
 
 class DOMAttributeError(MupfError):
     def __init__(self, *args, **kwargs):
@@ -4,16 +4,52 @@
 function main() {
 
     // Main library object (skeleton)
-    window.mupf = {cmd: {}, hk:{}, pending: 0, fts: {}}
+    window.mupf = {cmd: {}, hk:{}, pending: 0, fts: {}, grps: {}, asn: {}, chks: {}, chkid: 0, chksize: 128*1024}
 
     // sends a data packet to the Python side
     mupf.send = function(msg) {
-        mupf.ws.send(JSON.stringify(msg))
-        if (msg[0]==1){    // mode=res
-            mupf.pending--
-            if (mupf.last_resolve && mupf.pending == 1)
-                mupf.last_resolve()
+        let grp = (msg[0]==1) ? mupf.grps[msg[1]] : undefined
+        if (grp !== undefined) {
+            // responses to a group of commands are sent together in one bundle, when all are ready
+            delete mupf.grps[msg[1]]
+            grp.push(msg)
+            if (grp.length == grp.n)
+                mupf.put(JSON.stringify([8, -1, grp.length, grp]))
         }
+        else
+            mupf.put(mupf.hk.putmsg(msg))
+        if (msg[0]==1)    // mode=res
+            mupf.settle()
+    }
+
+    // sends encoded data, longer than `mupf.chksize` in chunks interleaved with other messages
+    mupf.put = function(data) {
+        if (data.length <= mupf.chksize) {
+            mupf.ws.send(data)
+            return
+        }
+        mupf.pending++    // `*last*` waits until all chunks are sent
+        mupf.putchks(data).then(mupf.settle)
+    }
+
+    mupf.putchks = async function(data) {
+        let id = ++mupf.chkid
+        for (let pos = 0; pos < data.length; ) {
+            let end = pos + mupf.chksize
+            // a surrogate pair is not split
+            if (typeof(data) === "string" && (data.charCodeAt(end-1) & 0xFC00) === 0xD800) end--
+            let piece = data.slice(pos, end)
+            pos = end
+            mupf.ws.send(mupf.hk.putchk([4, id, (pos < data.length) ? 1 : 0, piece]))
+            await new Promise((ok) => setTimeout(ok, 0))    // other messages can be sent in the meantime
+        }
+    }
+
+    // a command is finished (answered or cancelled)
+    mupf.settle = function() {
+        mupf.pending--
+        if (mupf.last_resolve && mupf.pending == 1)
+            mupf.last_resolve()
     }
 
     class MupfError extends Error {
@@ -27,11 +63,16 @@ function main() {
     mupf.hk.fndcmd = (n) => mupf.cmd[n]
     mupf.hk.ccall = (f, pyld) => f.call(window, pyld.args, pyld.kwargs)
     mupf.hk.getmsg = (ev) => JSON.parse(ev.data)
+    mupf.hk.putmsg = (msg) => JSON.stringify(msg)
+    mupf.hk.putchk = (msg) => JSON.stringify(msg)
+    mupf.hk.joinchk = (pieces) => JSON.parse(pieces.join(''))
     // chainable:
     mupf.hk.presend = (msg, cmd) => [msg, cmd]
     mupf.hk.postntf = (msg, cmd) => [msg, cmd]  // TODO: temporarily removed - recreate
     mupf.hk.postcmd = (msg, cmd) => [msg, cmd]
     mupf.hk.preclose = () => undefined
+    // a running async command is cancelled, its result will be dropped
+    mupf.hk.cancel = (msg, cmd) => undefined
 
     mupf.res = function(msg, result, cmd) {
         if (result === undefined) result = null
@@ -52,9 +93,14 @@ function main() {
                     throw new MupfError('CommandUnknownError', msg[2])
                 }
                 result = mupf.hk.ccall(cmd, msg[3])
-                if (result instanceof Promise)
-                    result.then((r) => mupf.res(msg, r, cmd))
-                else
+                if (result instanceof Promise) {
+                    mupf.asn[msg[1]] = cmd
+                    result.then((r) => {
+                        if (!(msg[1] in mupf.asn)) return    // cancelled
+                        delete mupf.asn[msg[1]]
+                        mupf.res(msg, r, cmd)
+                    })
+                } else
                     mupf.res(msg,result,cmd)
             } catch (err) {
                 let errname = err.constructor.name
@@ -71,8 +117,46 @@ function main() {
             // here `postntf`
             return
 
+        } else if (mode === 3){    // cancel of a command
+            let cmd = mupf.asn[msg[1]]
+            if (cmd === undefined) return    // already answered, or skipped
+            delete mupf.asn[msg[1]]
+            mupf.hk.cancel(msg, cmd)
+            // the cancel is acknowledged with an empty response, dropped by the Python side (in a group as well)
+            mupf.send([1, msg[1], 0, {result: null}])
+        } else if (mode === 4){    // chunk of a long message
+            if (msg[2] < 0) {    // the message is abandoned
+                delete mupf.chks[msg[1]]
+                return
+            }
+            let pieces = mupf.chks[msg[1]]
+            if (pieces === undefined) pieces = mupf.chks[msg[1]] = []
+            pieces.push(msg[3])
+            if (msg[2] === 0) {
+                delete mupf.chks[msg[1]]
+                mupf.recv(mupf.hk.joinchk(pieces))
+            }
         } else if (mode === 6){
             mupf.clb.waiting[msg[1]](msg[3])
+        } else if (mode === 8){    // bundle of messages
+            // a command cancelled in the same bundle is skipped, and the cancel is acknowledged
+            let cnl = new Set()
+            for (let m of msg[3]) if (m[0] === 3) cnl.add(m[1])
+            for (let m of msg[3]) {
+                if (m[0] !== 0 || !cnl.has(m[1])) mupf.recv(m)
+                else {
+                    mupf.pending++
+                    mupf.send([1, m[1], 0, {result: null}])
+                }
+            }
+        } else if (mode === 9){    // group of commands
+            let grp = []
+            grp.n = 0
+            for (let m of msg[3]) if (m[0] === 0) {
+                mupf.grps[m[1]] = grp
+                grp.n++
+            }
+            for (let m of msg[3]) mupf.recv(m)
         } else {
             // unknown mode
         }
@@ -12,4 +12,7 @@
     // #include static/core-clb.js
     // #include static/core-esc.js
     // #include static/core-hk.js
+    // #if binary_framing
+        // #include static/core-frm.js
+    // #endif binary_framing
 // #endif core_features
@@ -1,6 +1,9 @@
 // #if friendly_obj_names
 //     #define core_features
 // #endif
+// #if binary_framing
+//     #define core_features
+// #endif
 // #
 // #if core_features
 Object.freeze(Object.assign(window.mupf.fts, {
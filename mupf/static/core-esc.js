@@ -1,7 +1,8 @@
 mupf.esc = {
     "~": function(x, opt){
         this._enhb.push(opt)
-        let r =  this.decode(x)
+        let r = (opt.a === undefined) ? this.decode(x) : this._patch(x, opt.a)
+        if (opt.r !== undefined) this._deref(r, opt.r)
         opt = this._enhb.pop()
         if (opt.proms !== undefined){
             console.log(opt.proms)
@@ -10,6 +11,7 @@ mupf.esc = {
     },
     "~~": function(x){ for(let i=0; i<x.length; i++) x[i] =  this.decode(x[i]); return x },
     "~-": (x) => x,
+    "~^": (address) => new mupf.esc.Ref(address),
 // #if friendly_obj_names
     "~@": (x) => mupf.obj.byid(mupf.esc.decode(x))[0],
 // #else
@@ -24,6 +26,12 @@ mupf.esc = {
             throw new mupf.MupfError('NotImplementedError', "compound commands")
     },
     "~S": (x) => special[ mupf.esc.decode(x)],
+    "~B": function(data, type){
+        let bin = atob(data)
+        let bytes = new Uint8Array(bin.length)
+        for (let i=0; i<bin.length; i++) bytes[i] = bin.charCodeAt(i)
+        return (type === undefined) ? bytes : new window[type](bytes.buffer)
+    },
     special: {'undefined': undefined, 'NaN': NaN, 'Infinity': Infinity, '-Infinity': -Infinity},
     _enhb: [],
     decode: function(x) {
@@ -41,6 +49,41 @@ mupf.esc = {
         }
         return x
     },
+    _b64: function(x){
+        let bytes = (x instanceof ArrayBuffer) ? new Uint8Array(x) : new Uint8Array(x.buffer, x.byteOffset, x.byteLength)
+        let bin = ''
+        // `String.fromCharCode()` in pieces, because the number of arguments of a function is limited
+        for (let i=0; i<bytes.length; i+=0x8000) bin += String.fromCharCode.apply(null, bytes.subarray(i, i+0x8000))
+        return btoa(bin)
+    },
+    _patch: function(x, addrs) {
+        // Only the escapes at given addresses are decoded (in place), the rest of `x` is left as it is
+        let last = null
+        for (let addr of addrs) {
+            // Addresses are in the order of encoding, so the escapes nested in an already decoded subtree follow it
+            if (last !== null && last.length <= addr.length && last.every((k, i) => k === addr[i])) continue
+            if (addr.length === 0) return mupf.esc.decode(x)
+            let parent = x
+            for (let i=0; i<addr.length-1; i++) parent = parent[addr[i]]
+            let key = addr[addr.length-1]
+            parent[key] = mupf.esc.decode(parent[key])
+            last = addr
+        }
+        return x
+    },
+    _deref: function(root, sites) {
+        // Back-references (`mupf.esc.Ref`) at given addresses are replaced by the objects they refer to
+        let at = (address, length) => {
+            let x = root
+            for (let i=0; i<length; i++) x = x[address[i]]
+            return x
+        }
+        for (let site of sites) {
+            let parent = at(site, site.length-1)
+            let key = site[site.length-1]
+            parent[key] = at(parent[key].address, parent[key].address.length)
+        }
+    },
     _isesc: function(x){
         return (Array.isArray(x) && (x.length > 1) && (typeof(x[0])==="string") && (x[0].substr(0,1)==="~"))
     },
@@ -54,6 +97,10 @@ mupf.esc = {
                 return x
         }
         if (x === null) return x
+        if (x instanceof ArrayBuffer || ArrayBuffer.isView(x)){
+            enhb.c += 1
+            return ["~B", mupf.esc._b64(x), x.constructor.name]
+        }
         if (typeof(x) === 'object' || typeof(x) === 'function'){
             let out
             if (x.constructor === mupf.esc.Any){
@@ -76,6 +123,11 @@ mupf.esc = {
         }
         return x
     },
+    Ref: class {
+        constructor(address) {
+            this.address = address
+        }
+    },
     Any: class {
         constructor(obj, this_) {
             this.obj = obj
@@ -0,0 +1,59 @@
+// Binary framing of CRRCAN messages. The header (little-endian) is: mode (uint8), ccid (int32), type of noun (uint8)
+// and the noun -- int32 (type 0) or uint16 length and UTF-8 bytes of a string (type 1). The payload (JSON in UTF-8)
+// follows. Messages in text (JSON) are still understood in both directions. The payload of a chunk (mode 4) is a raw
+// piece of a binary framed message.
+mupf.frm = {
+    te: new TextEncoder(),
+    td: new TextDecoder(),
+    pack: function(msg) {
+        return mupf.frm.packraw(msg, mupf.frm.te.encode(JSON.stringify(msg[3])))
+    },
+    packraw: function(msg, pyld) {
+        let noun = (typeof(msg[2]) === "string") ? mupf.frm.te.encode(msg[2]) : null
+        let start = (noun === null) ? 10 : 8 + noun.length
+        let buf = new Uint8Array(start + pyld.length)
+        let view = new DataView(buf.buffer)
+        view.setUint8(0, msg[0])
+        view.setInt32(1, msg[1], true)
+        if (noun === null) {
+            view.setUint8(5, 0)
+            view.setInt32(6, msg[2], true)
+        } else {
+            view.setUint8(5, 1)
+            view.setUint16(6, noun.length, true)
+            buf.set(noun, 8)
+        }
+        buf.set(pyld, start)
+        return buf
+    },
+    unpack: function(buf) {
+        let view = new DataView(buf)
+        let bytes = new Uint8Array(buf)
+        let noun, start
+        if (view.getUint8(5) === 0) {
+            noun = view.getInt32(6, true)
+            start = 10
+        } else {
+            start = 8 + view.getUint16(6, true)
+            noun = mupf.frm.td.decode(bytes.subarray(8, start))
+        }
+        let mode = view.getUint8(0)
+        let pyld = bytes.subarray(start)
+        return [mode, view.getInt32(1, true), noun, (mode === 4) ? pyld : JSON.parse(mupf.frm.td.decode(pyld))]
+    },
+}
+
+mupf.ws.binaryType = 'arraybuffer'
+mupf.hk.getmsg = (ev) => (typeof(ev.data) === "string") ? JSON.parse(ev.data) : mupf.frm.unpack(ev.data)
+mupf.hk.putmsg = (msg) => mupf.frm.pack(msg)
+mupf.hk.putchk = (msg) => (typeof(msg[3]) === "string") ? JSON.stringify(msg) : mupf.frm.packraw(msg, msg[3])
+mupf.hk.joinchk = function(pieces) {
+    if (typeof(pieces[0]) === "string") return JSON.parse(pieces.join(''))
+    let buf = new Uint8Array(pieces.reduce((n, piece) => n + piece.length, 0))
+    let pos = 0
+    for (let piece of pieces) {
+        buf.set(piece, pos)
+        pos += piece.length
+    }
+    return mupf.frm.unpack(buf.buffer)
+}
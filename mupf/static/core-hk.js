@@ -4,12 +4,16 @@ mupf.hk.ccall = function(f, pyld) {
 }
 
 mupf.hk.presend = function(msg, cmd) {
-    let enhb = {c: 0, noautoesc: cmd.noautoesc}
-    if (msg[0] == 1)
+    let enhb = {c: 0, a: [], noautoesc: cmd.noautoesc}
+    if (msg[0] == 1) {
         msg[3].result = mupf.esc.encode(msg[3].result, enhb)
+        if (mupf.esc._isesc(msg[3].result)) enhb.a.push(["result"])
+    }
     else if (msg[0] == 5) {
-        for (let i=0; i<msg[3].args.length; i++)
+        for (let i=0; i<msg[3].args.length; i++) {
             msg[3].args[i] = mupf.esc.encode(msg[3].args[i], enhb)
+            if (mupf.esc._isesc(msg[3].args[i])) enhb.a.push(["args", i])
+        }
     }
 
     if (enhb.c > 0){
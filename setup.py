@@ -5,6 +5,6 @@ setup(
     version="0.1",
     packages=find_namespace_packages(include=('mupf', 'mupf.*', 'mupf.plugins')),
     install_requires=[
-    	'websockets>=7.0',
+    	'websockets>=8.0',
     ]
 )
@@ -0,0 +1,52 @@
+"""Benchmark of the same update sent to many clients
+
+A number of `FakeBrowser` clients (see `fake_browser.py`) are summoned, and the same notification with a sizable
+payload is sent to all of them, either with a `.run()` of each client, or with a single `App.broadcast_run()`. The rate
+of updates (one update is a message to every client) is reported, with the time spent in the sending thread.
+
+Run as `python bench_broadcast.py [--clients N] [--count N] [--port PORT]` with `mupf` importable.
+"""
+import argparse
+import sys
+import time
+
+import mupf
+
+from fake_browser import FakeBrowser
+
+PAYLOAD = [{'id': n, 'name': f'row {n}', 'value': n * 1.5, 'tags': ['a', 'b', 'c']} for n in range(100)]
+
+
+def measure(app, clients, count, send):
+    start = [client.received for client in clients]
+    t0 = time.perf_counter()
+    for n in range(count):
+        send(app, clients, n)
+    sending = time.perf_counter() - t0
+    for client, received in zip(clients, start):
+        client.wait_for_received(received + count)
+    return count / (time.perf_counter() - t0), count / sending
+
+def each_client(app, clients, n):
+    for client in clients:
+        client.command('update').run(n, PAYLOAD)
+
+def broadcast(app, clients, n):
+    app.broadcast_run('update', n, PAYLOAD)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--port', type=int, default=mupf.App.default_port)
+    args = parser.parse_args()
+    with mupf.App(port=args.port) as app:
+        clients = [app.summon_client(frontend=FakeBrowser) for _ in range(args.clients)]
+        for name, send in (('each client', each_client), ('broadcast', broadcast)):
+            rate, sending_rate = measure(app, clients, args.count, send)
+            print(f'{name:12} {rate:8.0f} updates/s  (sending thread {sending_rate:8.0f} updates/s)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""Benchmark of the command machinery of a client without any communication
+
+The commands are issued to a client which resolves them at once in a separate "server" thread, so only the Py-side
+machinery is measured: ccid allocation, registration of unresolved commands, resolution and waking up of the waiting
+threads. Each thread issues a burst of commands and then collects all the results. The total rate of all threads is
+reported with the speedup relative to one thread. With the GIL the speedup cannot be linear, the point is that it
+should not drop with more threads.
+
+Run as `python bench_ccid.py [--count N] [--threads 1 2 4 8 16]` with `mupf` importable.
+"""
+import argparse
+import queue
+import sys
+import threading
+import time
+
+from mupf import _command
+
+
+class BenchClient:
+    """ A client resolving all commands in its own thread, with already decoded responses
+    """
+    def __init__(self):
+        self._cid = 'bench0'
+        self._sent = queue.SimpleQueue()
+        self.command = _command.create_command_class_for_client(self)
+        threading.Thread(target=self._server, daemon=True).start()
+
+    def _send(self, data):
+        self._sent.put(data[1])
+
+    def _server(self):
+        while True:
+            ccid = self._sent.get()
+            self.command.set_resolved_mupf(ccid, [1, ccid, 0, {'result': ccid}])
+
+    def _decode_crrcan_msg(self, msg):
+        return msg
+
+
+def producer(client, count, barrier):
+    barrier.wait()
+    commands = [client.command('nop')(n) for n in range(count)]
+    for cmd in commands:
+        cmd.result
+
+def measure(client, thread_count, count):
+    barrier = threading.Barrier(thread_count + 1)
+    threads = [
+        threading.Thread(target=producer, args=(client, count // thread_count, barrier))
+        for _ in range(thread_count)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return (count // thread_count) * thread_count / (time.perf_counter() - t0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=160_000, help='number of commands (in total, for all threads)')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+    client = BenchClient()
+    base = None
+    for thread_count in args.threads:
+        rate = max(measure(client, thread_count, args.count) for _ in range(3))
+        base = base or rate
+        print(f'{thread_count:3} threads: {rate:10.0f} cmd/s  (x{rate/base:.2f})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""Benchmark of short commands issued during a bulk transfer
+
+A `FakeBrowser` (see `fake_browser.py`) is summoned, and a command with a long payload is sent to it. From the moment
+it is issued (the chunks are sent while the payload is still being encoded), short commands are issued one after another
+(each waiting for its result) until it is answered.
+The round-trip latency of the short commands is reported with long messages sent as a whole (fragmented websocket messages, `chunk_size=None`) and in chunks interleaved
+with other messages.
+
+Run as `python bench_chunking.py [--size MB] [--port PORT]` with `mupf` importable.
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+
+import mupf
+
+from fake_browser import FakeBrowser
+
+
+def latencies_during_transfer(client, payload):
+    latencies = []
+    started = threading.Event()
+    done = threading.Event()
+
+    def bulk():
+        started.set()
+        client.command('store')(payload).wait
+        done.set()
+
+    threading.Thread(target=bulk).start()
+    started.wait()
+    t0 = time.perf_counter()
+    while not done.is_set():
+        t = time.perf_counter()
+        client.command('nop')().result
+        latencies.append(time.perf_counter() - t)
+    return time.perf_counter() - t0, latencies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=100, help='size of the long message (in MB)')
+    parser.add_argument('--port', type=int, default=mupf.App.default_port)
+    args = parser.parse_args()
+    payload = 'x' * (args.size * 10**6)
+    for n, chunk_size in enumerate((None, 256*1024)):
+        with mupf.App(port=args.port + n, chunk_size=chunk_size, compression=False) as app:
+            client = app.summon_client(frontend=FakeBrowser)
+            total, latencies = latencies_during_transfer(client, payload)
+            latencies.sort()
+            print(
+                f'chunk_size={chunk_size!s:7}  transfer {total:6.2f} s,  {len(latencies):5} short commands, latency '
+                f'median {statistics.median(latencies)*1e3:7.1f} ms, max {latencies[-1]*1e3:7.1f} ms'
+            )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Microbenchmark of the value classification in `_enhjson.py`
+
+Compares the per-type cached `_enhjson.test_element_type` with the uncached chain of probes (`_probe_element_type`), on
+its own and as a part of `_enhjson.encode` with the `Client._escape_for_json` escape, for large lists and dicts of
+primitives.
+
+Run as `python bench_classify.py` with `mupf` importable.
+"""
+import gc
+import time
+
+from mupf import _enhjson as j
+from mupf._remote import RemoteObj
+from mupf.client import Client
+
+SIZE = 100_000
+
+
+def uncached_escape(value):
+    # `Client._escape_for_json` as it was before the per-type cache
+    if isinstance(value, RemoteObj):
+        return '@', None
+    json_type = j._probe_element_type(value)
+    if json_type == j.JsonElement.Unknown:
+        return j.JsonElement.Autonomous
+    return json_type
+
+def cached_escape(value):
+    return Client._escape_for_json(None, value)
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def classify_all(classify, values):
+    for x in values:
+        classify(x)
+
+def encode_enhanced(payload, escape):
+    # A new `EnhancedBlock` each time, because it keeps the state of the encoding
+    return j.encode(j.EnhancedBlock(payload), escape=escape)
+
+def main():
+    payloads = {
+        'list of ints': list(range(SIZE)),
+        'list of floats': [x/7 for x in range(SIZE)],
+        'list of strs': [f'item{x}' for x in range(SIZE)],
+        'list of mixed': [(x, str(x), x/3, None, True)[x % 5] for x in range(SIZE)],
+        'dict of ints': {f'k{x}': x for x in range(SIZE)},
+        'list of dicts': [{'id': x, 'name': 'n', 'ok': True} for x in range(SIZE//4)],
+    }
+    gc.disable()
+    print(f'{"payload":>15} | {"probe":>9} {"cached":>9} | {"encode, probe":>14} {"encode, cached":>14}')
+    for name, payload in payloads.items():
+        values = list(payload.values()) if isinstance(payload, dict) else payload
+        t_probe = best_of(5, classify_all, j._probe_element_type, values)
+        t_cached = best_of(5, classify_all, j.test_element_type, values)
+        t_enc_probe = best_of(5, encode_enhanced, payload, uncached_escape)
+        t_enc_cached = best_of(5, encode_enhanced, payload, cached_escape)
+        print(
+            f'{name:>15} | {t_probe*1000:6.1f} ms {t_cached*1000:6.1f} ms '
+            f'| {t_enc_probe*1000:11.1f} ms {t_enc_cached*1000:11.1f} ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
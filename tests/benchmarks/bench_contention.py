@@ -0,0 +1,57 @@
+"""Benchmark of many threads issuing commands to a single client
+
+A `FakeBrowser` (see `fake_browser.py`) is summoned, and for each number of threads the threads issue commands to it at
+the same time. Each thread sends a burst of commands and then collects all the results (pipelined), so the rate is
+limited by the Py-side of the command machinery: ccid allocation, registration of unresolved commands, resolution and
+waking up of the waiting threads. The total rate of all threads is reported with the speedup relative to one thread.
+
+Run as `python bench_contention.py [--count N] [--threads 1 2 4 8 16] [--port PORT]` with `mupf` importable.
+"""
+import argparse
+import sys
+import threading
+import time
+
+import mupf
+
+from fake_browser import FakeBrowser
+
+
+def producer(client, count, barrier):
+    barrier.wait()
+    commands = [client.command('nop')(n) for n in range(count)]
+    for cmd in commands:
+        cmd.result
+
+def measure(client, thread_count, count):
+    barrier = threading.Barrier(thread_count + 1)
+    threads = [
+        threading.Thread(target=producer, args=(client, count // thread_count, barrier))
+        for _ in range(thread_count)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return (count // thread_count) * thread_count / (time.perf_counter() - t0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=64_000, help='number of commands (in total, for all threads)')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--port', type=int, default=mupf.App.default_port)
+    args = parser.parse_args()
+    with mupf.App(port=args.port) as app:
+        client = app.summon_client(frontend=FakeBrowser)
+        base = None
+        for thread_count in args.threads:
+            rate = measure(client, thread_count, args.count)
+            base = base or rate
+            print(f'{thread_count:3} threads: {rate:10.0f} cmd/s  (x{rate/base:.2f})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Benchmark corpus of the enhanced JSON codec (`_enhjson.py`)
+
+Measures the throughput of the encoding, `_enhjson.decode` and `_enhjson.decode_enhblock`, and the memory allocated by
+them (peak of `tracemalloc`), for a corpus of typical and pathological payloads. The encoding is the one of the send path
+of `Client._send`, that is `_enhjson.iterencode` with the `Client._escape_for_json` escape, the fast path and the default
+`chunk_size` of `App`, with the chunks dropped as they come, like when they are sent.
+
+Run as `python bench_enhjson.py [--output results.json] [--compare baseline.json] [--repeat N]` with `mupf`
+importable. The results are written as JSON, so the results of two versions of the codec can be compared with
+`--compare` (a ratio of times, less than 1.0 is better).
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+from mupf import App, _enhjson as j
+from mupf._remote import RemoteObj
+from mupf.client import Client
+
+
+class BenchClient:
+    """ The minimum of `Client` needed by `RemoteObj` and `Client._escape_for_json`
+    """
+    def __init__(self):
+        self._cid = 'bench0'
+        self.command = set()    # `set` can be weak referenced
+        self._clbid_by_callbacks = {}
+        self._callbacks_by_clbid = {}
+        self._callback_free_id = 0
+        self._healthy_connection = False    # `RemoteObj.__del__` must not send anything
+
+    _get_callback_id = Client._get_callback_id
+    _escape_for_json = Client._escape_for_json
+
+    def get_remote_obj(self, rid, ctxrid=None):
+        return rid
+
+
+def make_corpus(client):
+    callbacks = [(lambda n: (lambda: n))(n) for n in range(100)]
+    return {
+        'wide dict': {f'key{n}': n for n in range(100_000)},
+        'deep nesting': _nested(200),    # `decode` recurses two frames per level
+        'long strings': [('<td class="cell">Lorem "ipsum"</td>\n' * 2000) for _ in range(50)],
+        'numeric list': [n/7 for n in range(200_000)],
+        'int list': list(range(200_000)),
+        'records': [{'id': n, 'name': f'row {n}', 'ok': n % 2 == 0, 'tags': ['a', 'b']} for n in range(20_000)],
+        'remote objects': [RemoteObj(n, client) for n in range(20_000)],
+        'callbacks': [callbacks[n % 100] for n in range(20_000)],
+        'mixed escapes': [{'node': RemoteObj(n, client), 'onclick': callbacks[n % 100], 'x': n} for n in range(10_000)],
+        '"~" collisions': [['~tilde', n] for n in range(20_000)],
+    }
+
+def _nested(depth):
+    value = {'leaf': [1, 2, 3]}
+    for n in range(depth):
+        value = {'level': n, 'child': value, 'items': [n, str(n)]}
+    return value
+
+def measure(repeat, func, *args):
+    """ The best time of `repeat` runs, and the peak of memory allocated in one run
+    """
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+def iterencode_message(client, payload, chunk_size):
+    # A fresh `EnhancedBlock` each time, because it keeps the state of the encoding
+    block = j.EnhancedBlock(payload, opt=j.OptPolicy.addresses)
+    return j.iterencode(
+        [0, 1, '*bench*', block], escape=client._escape_for_json, chunk_size=chunk_size, fast_path=True
+    )
+
+def encode_message(client, payload, chunk_size):
+    """ Encodes like `Client._send`, only the length of the chunks is kept """
+    return sum(len(chunk) for chunk in iterencode_message(client, payload, chunk_size))
+
+def run(repeat):
+    client = BenchClient()
+    chunk_size = App()._chunk_size
+    decoders = {'@': client.get_remote_obj, '$': lambda *args: args}
+    results = {}
+    for name, payload in make_corpus(client).items():
+        t_enc, mem_enc, size = measure(repeat, encode_message, client, payload, chunk_size)
+        message = json.loads(''.join(iterencode_message(client, payload, chunk_size)))
+        raw_payload = json.dumps(message[3])
+        # `decode_enhblock` and `decode` work in place on the parsed JSON, so a fresh copy is parsed each time
+        t_dec, mem_dec, _ = measure(repeat, lambda: j.decode(json.loads(raw_payload), decoders))
+        t_blk, mem_blk, _ = measure(repeat, lambda: j.decode_enhblock(json.loads(raw_payload), decoders))
+        t_parse, _, _ = measure(repeat, json.loads, raw_payload)
+        results[name] = {
+            'size': size,
+            'encode_s': t_enc,
+            'encode_peak_bytes': mem_enc,
+            'encode_mb_per_s': size / t_enc / 1e6,
+            # `json.loads` is the same for both, so it is subtracted
+            'decode_s': max(t_dec - t_parse, 0.0),
+            'decode_peak_bytes': mem_dec,
+            'decode_enhblock_s': max(t_blk - t_parse, 0.0),
+            'decode_enhblock_peak_bytes': mem_blk,
+        }
+        print(
+            f'{name:>16}: {size/1e6:6.2f} MB | encode {t_enc*1000:8.2f} ms {mem_enc/1e6:7.2f} MB '
+            f'| decode {results[name]["decode_s"]*1000:8.2f} ms | decode_enhblock '
+            f'{results[name]["decode_enhblock_s"]*1000:8.2f} ms'
+        )
+    return results
+
+def compare(results, baseline):
+    print()
+    print(f'{"payload":>16}: {"encode":>8} {"decode":>8} {"enhblock":>8}  (time ratios to the baseline)')
+    for name, current in results.items():
+        if name not in baseline:
+            continue
+        ratios = [
+            current[key] / baseline[name][key] if baseline[name][key] else float('nan')
+            for key in ('encode_s', 'decode_s', 'decode_enhblock_s')
+        ]
+        print(f'{name:>16}: ' + ' '.join(f'{r:8.2f}' for r in ratios))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output', help='file to write the results to (JSON)')
+    parser.add_argument('--compare', help='file with the results of the baseline (JSON)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    results = run(args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,61 @@
+"""Benchmark of many clients served by one or more event loop threads of the `App`
+
+For each number of loop threads (see `loop_threads` of `App`) a few `FakeBrowser` clients (see `fake_browser.py`) are
+summoned, and each client gets its own thread issuing commands (pipelined) to it. The total rate of all clients is
+reported. With more loop threads the clients are spread over the loops, so the websocket work of one client does not
+wait for the others in a single loop. With the GIL the speedup cannot be linear, the Py-side of the commands and the
+fake browsers themselves run in the same process.
+
+Run as `python bench_loops.py [--count N] [--clients N] [--loops 1 2 4] [--port PORT]` with `mupf` importable.
+"""
+import argparse
+import sys
+import threading
+import time
+
+import mupf
+
+from fake_browser import FakeBrowser
+
+
+def producer(client, count, barrier):
+    barrier.wait()
+    commands = [client.command('nop')(n) for n in range(count)]
+    for cmd in commands:
+        cmd.result
+
+def measure(clients, count):
+    barrier = threading.Barrier(len(clients) + 1)
+    threads = [
+        threading.Thread(target=producer, args=(client, count // len(clients), barrier))
+        for client in clients
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    t0 = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return (count // len(clients)) * len(clients) / (time.perf_counter() - t0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=64_000, help='number of commands (in total, for all clients)')
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--loops', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--port', type=int, default=mupf.App.default_port)
+    args = parser.parse_args()
+    base = None
+    for loop_threads in args.loops:
+        app = mupf.App(port=args.port, loop_threads=loop_threads).open()
+        clients = [app.summon_client(frontend=FakeBrowser) for _ in range(args.clients)]
+        rate = measure(clients, args.count)
+        # The ports are reused in the next run
+        app.close(wait=True)
+        base = base or rate
+        print(f'{loop_threads:3} loops: {rate:10.0f} cmd/s  (x{rate/base:.2f})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
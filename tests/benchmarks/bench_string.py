@@ -0,0 +1,64 @@
+"""Benchmark of string escaping in `_enhjson.py`
+
+Compares `_enhjson._encode_string` with the reference implementation (one `write()` of the `_string_esc` lookup table
+per byte of UTF-8). The output of both must be byte-identical for all samples, and the current implementation must be
+at least `MIN_SPEEDUP` times faster on a 1 MB `innerHTML`-like payload. The other samples are reported for information
+only -- the more distinct escapable characters and non-ASCII characters, the smaller the gain.
+
+Run as `python bench_string.py` with `mupf` importable.
+"""
+import gc
+import io
+import sys
+import time
+
+from mupf import _enhjson as j
+
+MIN_SPEEDUP = 20
+SIZE = 1024*1024
+REQUIRED_FOR = 'innerHTML'
+
+SAMPLES = {
+    'innerHTML': '<tr class="row"><td id="c1">Lorem ipsum dolor sit amet</td><td>42.0</td></tr>\n',
+    'log dump': '2020-06-01 12:00:00 [INFO] Zażółć gęślą jaźń -- "C:\\temp\\file.txt"\tok\n',
+    'dense escapes': '"\\"\t\n\r\x01\x1f"\\"\t\n\r\x01\x1f',
+}
+
+
+def reference_encode_string(s, stream):
+    stream.write(b'"')
+    for i in str(s).encode('utf-8'):
+        stream.write(j._string_esc[i])
+    stream.write(b'"')
+
+def measure(encode_string, stream_class, sample, repeat):
+    best = None
+    for _ in range(repeat):
+        stream = stream_class()
+        t0 = time.perf_counter()
+        encode_string(sample, stream)
+        value = stream.getvalue()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, (value if isinstance(value, bytes) else value.encode('utf-8'))
+
+def main():
+    failed = False
+    gc.disable()
+    for name, chunk in SAMPLES.items():
+        sample = (chunk * (SIZE // len(chunk) + 1))[:SIZE]
+        t_ref, out_ref = measure(reference_encode_string, io.BytesIO, sample, 5)
+        t_new, out_new = measure(j._encode_string, j._Output, sample, 10)
+        speedup = t_ref / t_new
+        print(f'{name:>15}: reference {t_ref*1000:8.2f} ms, current {t_new*1000:7.2f} ms, speedup {speedup:6.1f}x')
+        if out_ref != out_new:
+            print(f'FAIL: output for `{name}` differs from the `_string_esc` lookup table')
+            failed = True
+        if name == REQUIRED_FOR and speedup < MIN_SPEEDUP:
+            print(f'FAIL: speedup for `{name}` smaller than {MIN_SPEEDUP}x')
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""Benchmark matrix of the websocket transport options of `App`
+
+For each configuration of the compression options a `FakeBrowser` (see `fake_browser.py`) is summoned and typical CRRCAN
+traffic is measured: short commands issued one after another (the latency of a round trip, and the bytes on the wire
+per message), and notifications with a sizable payload, e.g. a table to render (the rate, and the bytes on the wire per
+message). The bytes are counted on the receiving side of the fake browser, so they include the websocket framing.
+
+Run as `python bench_transport.py [--count N] [--port PORT]` with `mupf` importable.
+"""
+import argparse
+import statistics
+import sys
+import time
+
+import mupf
+
+from fake_browser import FakeBrowser
+
+CONFIGS = [
+    ('no compression', dict(compression=False)),
+    ('deflate, level 1', dict(compression_level=1)),
+    ('deflate, default', dict()),
+    ('deflate, level 9', dict(compression_level=9)),
+    ('deflate, threshold 1 KiB', dict(compression_threshold=1024)),
+    ('deflate, 9-bit window', dict(compression_window_bits=9)),
+]
+
+TABLE = [
+    {'id': n, 'name': f'item {n}', 'price': round(n * 1.37, 2), 'tags': ['new', 'sale'][:n % 3], 'visible': n % 2 == 0}
+    for n in range(200)
+]
+
+
+def short_commands(client, count):
+    latencies = []
+    wire_bytes = client.wire_bytes
+    for n in range(count):
+        t0 = time.perf_counter()
+        client.command('nop')(n, 'label').result
+        latencies.append(time.perf_counter() - t0)
+    return statistics.median(latencies) * 1e6, (client.wire_bytes - wire_bytes) / count
+
+def bulk_notifications(client, count):
+    start = client.received
+    wire_bytes = client.wire_bytes
+    t0 = time.perf_counter()
+    for n in range(count):
+        client.command('render').run(n, TABLE)
+    client.wait_for_received(start + count)
+    return count / (time.perf_counter() - t0), (client.wire_bytes - wire_bytes) / count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--port', type=int, default=mupf.App.default_port)
+    args = parser.parse_args()
+    print(f'{"":26} {"short commands":>26}   {"bulk notifications":>28}')
+    print(f'{"configuration":26} {"latency":>12} {"wire/msg":>13}   {"rate":>14} {"wire/msg":>13}')
+    for n, (name, options) in enumerate(CONFIGS):
+        # Each configuration gets its own port, so a socket of the previous one lingering in the system does not matter
+        with mupf.App(port=args.port + n, **options) as app:
+            client = app.summon_client(frontend=FakeBrowser)
+            latency, short_wire = short_commands(client, args.count)
+            rate, bulk_wire = bulk_notifications(client, args.count // 10)
+            print(f'{name:26} {latency:9.0f} µs {short_wire:7.0f} bytes   {rate:8.0f} msg/s {bulk_wire:7.0f} bytes')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
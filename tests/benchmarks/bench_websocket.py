@@ -0,0 +1,83 @@
+"""Benchmark of the websocket communication of a single client
+
+A `FakeBrowser` (see `fake_browser.py`) is summoned and the rate of messages going through the websocket is measured
+for: a burst of notifications (`.run()`), a burst of commands with the results collected after all are sent
+(pipelined), commands issued one after another (each waiting for its result), and batches of ten commands
+(`client.command.batch()`, each batch waiting for its results), and commands awaited concurrently in a single
+coroutine. The notifications must go at least
+at `MIN_RATE` messages per second, the other numbers are reported for information only.
+
+Run as `python bench_websocket.py [--count N] [--port PORT] [--parse-once]` with `mupf` importable.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import mupf
+
+from fake_browser import FakeBrowser
+
+MIN_RATE = 50_000
+
+
+def notifications(client, count):
+    start = client.received
+    t0 = time.perf_counter()
+    for n in range(count):
+        client.command('nop').run(n)
+    client.wait_for_received(start + count)
+    return count / (time.perf_counter() - t0)
+
+def pipelined_commands(client, count):
+    t0 = time.perf_counter()
+    commands = [client.command('nop')(n) for n in range(count)]
+    for cmd in commands:
+        cmd.result
+    return count / (time.perf_counter() - t0)
+
+def batched_commands(client, count, size=10):
+    t0 = time.perf_counter()
+    for n in range(0, count, size):
+        with client.command.batch() as batch:
+            for k in range(size):
+                client.command('nop')(n + k)
+        batch.results
+    return count / (time.perf_counter() - t0)
+
+def awaited_commands(client, count):
+    async def run_all():
+        return await asyncio.gather(*(client.command('nop')(n) for n in range(count)))
+    t0 = time.perf_counter()
+    asyncio.run(run_all())
+    return count / (time.perf_counter() - t0)
+
+def sequential_commands(client, count):
+    t0 = time.perf_counter()
+    for n in range(count):
+        client.command('nop')(n).result
+    return count / (time.perf_counter() - t0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=200_000)
+    parser.add_argument('--port', type=int, default=mupf.App.default_port)
+    parser.add_argument('--parse-once', action='store_true', help='decode the messages in the server thread')
+    args = parser.parse_args()
+    with mupf.App(port=args.port, parse_once=args.parse_once) as app:
+        client = app.summon_client(frontend=FakeBrowser)
+        rate = notifications(client, args.count)
+        frames = client.frames
+        print(f'notifications:       {rate:10.0f} msg/s  ({args.count} messages in {frames} frames)')
+        print(f'pipelined commands:  {pipelined_commands(client, args.count // 10):10.0f} msg/s')
+        print(f'sequential commands: {sequential_commands(client, args.count // 100):10.0f} msg/s')
+        print(f'batches of 10:       {batched_commands(client, args.count // 10):10.0f} msg/s')
+        print(f'awaited commands:    {awaited_commands(client, args.count // 10):10.0f} msg/s')
+    if rate < MIN_RATE:
+        print(f'FAIL: notifications slower than {MIN_RATE} msg/s')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""A `Client` which talks to the `App` like a browser, but without one
+
+The `FakeBrowser` runs its own thread with an event loop. It fetches the bootstrap, connects to the websocket and
+answers the CRRCAN messages the way `bootstrap.js` does, without any core features (the chunked messages are put
+together, but the responses are never chunked). Commands are answered with the
+result of a handler from `FakeBrowser.commands` (`None` if there is no handler), notifications are only counted. It is
+a helper for the benchmarks -- it is not a test of the JS-side.
+"""
+import asyncio
+import json
+import threading
+import urllib.request
+
+import websockets
+
+from mupf.client import Client
+
+
+class _CountingProtocol(websockets.WebSocketClientProtocol):
+
+    def __init__(self, browser, **kwargs):
+        super().__init__(**kwargs)
+        self._browser = browser
+
+    def data_received(self, data):
+        self._browser.wire_bytes += len(data)
+        super().data_received(data)
+
+
+class FakeBrowser(Client):
+
+    commands = {
+        '*features*': lambda args, kwargs: {},
+    }
+
+    def __init__(self, app, client_id):
+        super().__init__(app, client_id)
+        self.received = 0
+        """ The number of messages received (the messages in bundles are counted separately) """
+        self.frames = 0
+        """ The number of websocket messages received """
+        self.wire_bytes = 0
+        """ The number of bytes received through the websocket connection (with the framing, compressed) """
+        self._received_cond = threading.Condition()
+        self._chunks = {}
+        self._thread = threading.Thread(target=asyncio.run, args=(self._browser(),), daemon=True)
+        self._thread.start()
+
+    def wait_for_received(self, count, timeout=None):
+        """ Blocks until `count` messages are received in total
+        """
+        with self._received_cond:
+            return self._received_cond.wait_for(lambda: self.received >= count, timeout)
+
+    async def _browser(self):
+        loop = asyncio.get_running_loop()
+        # The bootstrap request blocks until the Py-side is ready, and issues the `*first*` command
+        await loop.run_in_executor(None, lambda: urllib.request.urlopen(self.url + 'mupf/bootstrap').read())
+        async with websockets.connect(
+            'ws' + self.url[4:] + 'mupf/ws',
+            max_size = None,
+            create_protocol = lambda **kwargs: _CountingProtocol(self, **kwargs),
+        ) as ws:
+            await ws.send(json.dumps([1, 0, 0, {'result': {'cid': self.cid, 'ua': 'FakeBrowser'}}]))
+            try:
+                async for data in ws:
+                    self.frames += 1
+                    await self._recv(ws, json.loads(data))
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+    async def _recv(self, ws, msg, group=None):
+        mode, ccid, noun, payload = msg
+        if mode == 8:
+            for m in payload:
+                await self._recv(ws, m)
+            return
+        if mode == 4:
+            # A piece of a long message, or the end of an abandoned one
+            if noun < 0:
+                self._chunks.pop(ccid, None)
+                return
+            self._chunks.setdefault(ccid, []).append(payload)
+            if noun == 0:
+                await self._recv(ws, json.loads(''.join(self._chunks.pop(ccid))))
+            return
+        if mode == 9:
+            # The responses to a group of commands are sent in one bundle
+            group = []
+            for m in payload:
+                await self._recv(ws, m, group)
+            await ws.send(json.dumps([8, -1, len(group), group]))
+            return
+        with self._received_cond:
+            self.received += 1
+            self._received_cond.notify_all()
+        if mode == 0:
+            if noun == '*last*':
+                await ws.close(1000, '*last*')
+                return
+            handler = self.commands.get(noun)
+            result = handler(payload['args'], payload['kwargs']) if handler else None
+            if group is None:
+                await ws.send(json.dumps([1, ccid, 0, {'result': result}]))
+            else:
+                group.append([1, ccid, 0, {'result': result}])
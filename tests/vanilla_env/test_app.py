@@ -1,7 +1,10 @@
 """Test suite for the `_app.py` module
 """
+import asyncio
+import sys
 import unittest
 import mupf
+import websockets
 
 
 class App_Features(unittest.TestCase):
@@ -30,5 +33,135 @@ class App_Features(unittest.TestCase):
         self.assertEqual(str(cm.exception), '`feature` argumnet of `App` must be a **container** of features')
 
 
+class App_Broadcast(unittest.TestCase):
+
+    def setUp(self) -> None:
+        print(self.shortDescription())
+
+    def make_app(self):
+        # The clients are not connected, their messages stay on the outgoing queues
+        app = mupf.App()
+        app._event_loop = asyncio.new_event_loop()
+        app._event_loops = [app._event_loop]
+        self.addCleanup(app._event_loop.close)
+        clients = [mupf.client.Client(app, app.get_unique_client_id()) for _ in range(3)]
+        clients[2].features.add(+mupf.F.core_features)
+        return app, clients
+
+    def test_shared_payload(self):
+        "app: Command broadcast to many clients -> Messages equal to separately sent ones, results by cid"
+
+        app, clients = self.make_app()
+        broadcast = app.broadcast('update', [1, 'two', None], key={'k': 3.5})
+        # The clients with the same features send the same payload object
+        self.assertIs(clients[0]._outqueue[0][0][1], clients[1]._outqueue[0][0][1])
+        for client in clients:
+            call = client.command.update([1, 'two', None], key={'k': 3.5})
+            (shared, _), (single, _) = client._outqueue
+            shared = ''.join(shared)
+            self.assertEqual(shared.replace(f',{broadcast.calls[client.cid]._ccid},', f',{call._ccid},', 1), single)
+            client.command.set_resolved_mupf(call._ccid, f'[1,{call._ccid},0,{{"result":0}}]')
+            ccid = broadcast.calls[client.cid]._ccid
+            client.command.set_resolved_mupf(ccid, f'[1,{ccid},0,{{"result":"{client.cid}"}}]')
+        self.assertEqual(broadcast.results, {client.cid: client.cid for client in clients})
+
+    def test_client_specific_payload(self):
+        "app: Callback broadcast to many clients -> Payload encoded for each client"
+
+        app, clients = self.make_app()
+        for client in clients:
+            client.features.add(+mupf.F.core_features)
+        clients[0]._get_callback_id(len)
+        app.broadcast_run('on', print)
+        clbids = [client._get_callback_id(print) for client in clients]
+        self.assertNotEqual(clbids[0], clbids[1])
+        for client, clbid in zip(clients, clbids):
+            self.assertIn(f'["~$",null,{clbid}]', ''.join(client._outqueue[-1][0]))
+
+
+class App_LoopThreads(unittest.TestCase):
+
+    def setUp(self) -> None:
+        print(self.shortDescription())
+
+    def test_client_assignment(self):
+        "app: Clients of an app with many loop threads -> Spread evenly, each with the loop and port of its thread"
+
+        with self.assertRaises(ValueError):
+            mupf.App(loop_threads=0)
+        app = mupf.App(port=50000, loop_threads=3)
+        app._event_loops = [asyncio.new_event_loop() for _ in range(3)]
+        for loop in app._event_loops:
+            self.addCleanup(loop.close)
+        clients = [mupf.client.Client(app, app.get_unique_client_id()) for _ in range(4)]
+        self.assertEqual([client._loop_index for client in clients], [0, 1, 2, 0])
+        del app._clients_by_cid[clients[1].cid]
+        client = mupf.client.Client(app, app.get_unique_client_id())
+        self.assertEqual(client._loop_index, 1)
+        self.assertIs(client._get_eventloop(), app._event_loops[1])
+        self.assertTrue(client.url.startswith('http://127.0.0.1:50001/'))
+
+        called = []
+        app.piggyback_call(called.append, client)
+        app._event_loops[1].run_until_complete(asyncio.sleep(0))
+        self.assertEqual(called, [client])
+
+        class WebSocket:
+            closed = None
+            async def close(self, code, reason):
+                self.closed = (code, reason)
+        websocket = WebSocket()
+        app._event_loops[2].run_until_complete(app._websocket_request(websocket, f'/mupf/{client.cid}/mupf/ws'))
+        self.assertEqual(websocket.closed, (1008, f'wrong port, use {client.url}'))
+
+
+class App_WebsocketOptions(unittest.TestCase):
+
+    def setUp(self) -> None:
+        print(self.shortDescription())
+
+    def test_extensions(self):
+        "app: Compression options of `App` -> Extension factory offered to the browser configured with them"
+
+        self.assertEqual(mupf.App(compression=False)._websocket_extensions(), [])
+        factory, = mupf.App(compression_level=1, compression_window_bits=9)._websocket_extensions()
+        self.assertIsInstance(factory, mupf._srvthr._PerMessageDeflateFactory)
+        self.assertEqual(factory.compress_settings, {'level': 1})
+        self.assertEqual((factory.server_max_window_bits, factory.client_max_window_bits), (9, 9))
+        self.assertEqual(factory._threshold, 0)
+
+    @unittest.skipIf(
+        sys.version_info >= (3, 10) and int(websockets.__version__.split('.')[0]) < 10,
+        'this `websockets` cannot open connections in this Python',
+    )
+    def test_serve_options(self):
+        "app: Websocket and compression options of `App` -> Set in the server side of a connection"
+
+        class App(mupf.App):
+            """ Records the server side of the incoming websocket, instead of passing it to a client """
+            async def _websocket_request(self, websocket, path):
+                self.websocket = websocket
+
+        app = App(
+            port = 57923, max_size = 12345, max_queue = 7, read_limit = 2**12, write_limit = 2**13,
+            compression_level = 9, compression_threshold = 100, compression_window_bits = 10,
+        )
+        with app:
+            async def connect():
+                async with websockets.connect('ws://127.0.0.1:57923/mupf/0/mupf/ws') as websocket:
+                    return websocket.extensions
+            client_extensions = asyncio.run(connect())
+        websocket = app.websocket
+        self.assertEqual(
+            (websocket.max_size, websocket.max_queue, websocket.read_limit, websocket.write_limit),
+            (12345, 7, 2**12, 2**13),
+        )
+        extension, = websocket.extensions
+        self.assertIsInstance(extension, mupf._srvthr._CompressionThreshold)
+        self.assertEqual(extension._threshold, 100)
+        self.assertEqual(extension._extension.local_max_window_bits, 10)
+        self.assertEqual(client_extensions[0].local_max_window_bits, 10)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
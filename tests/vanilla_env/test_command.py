@@ -0,0 +1,136 @@
+"""Test suite for the `_command.py` module
+"""
+
+import asyncio
+import threading
+import unittest
+
+from mupf import _command, exceptions
+
+
+class DummyClient:
+    """ A client which only records the sent messages, the responses are already decoded
+    """
+    def __init__(self):
+        self._cid = 'dummy0abcdefghABCDEFGH'
+        self.sent = []
+        self.command = _command.create_command_class_for_client(self)
+
+    def _send(self, data):
+        self.sent.append(data)
+
+    def _decode_crrcan_msg(self, msg):
+        return msg
+
+    def respond(self, ccid, result):
+        self.command.set_resolved_mupf(ccid, [1, ccid, 0, {'result': result}])
+
+
+class Command(unittest.TestCase):
+
+    def setUp(self) -> None:
+        print(self.shortDescription())
+
+    def test_concurrent_calls(self):
+        "command: One `Command` called from many threads -> Separate calls with own ccids and results"
+
+        client = DummyClient()
+        cmd = client.command.double
+        calls = []
+        threads = [threading.Thread(target=lambda n=n: calls.append(cmd(n))) for n in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({call._ccid for call in calls}), 16)
+        arg_by_ccid = {msg[1]: msg[3]['args'][0] for msg in client.sent}
+        for ccid, arg in arg_by_ccid.items():
+            client.respond(ccid, 2*arg)
+        for call in calls:
+            self.assertEqual(call.result, 2*arg_by_ccid[call._ccid])
+        self.assertEqual(sorted(arg_by_ccid.values()), list(range(16)))
+        self.assertIs(cmd.result, cmd._last_call.result)
+
+    def test_batch(self):
+        "command: Calls in a batch -> Sent as one group after the block, results not readable inside"
+
+        client = DummyClient()
+        with client.command.batch() as batch:
+            first = client.command.a(1)
+            client.command.b.run(2)
+            with self.assertRaises(RuntimeError):
+                first.result
+        self.assertEqual(len(client.sent), 1)
+        self.assertEqual(client.sent[0][0], 9)
+        self.assertEqual([msg[0] for msg in client.sent[0][3]], [0, 2])
+        client.respond(first._ccid, 'ok')
+        self.assertEqual(batch.results, ['ok', _command.NotificationNullResult])
+
+    def test_batch_format(self):
+        "command: Nested batches, batch left with an exception -> One group message `[9, -1, count, messages]`"
+
+        client = DummyClient()
+        with client.command.batch():
+            pass
+        self.assertEqual(client.sent, [])
+        with self.assertRaises(ValueError):
+            with client.command.batch() as batch:
+                first = client.command.a(1, x=2)
+                with client.command.batch() as inner:
+                    second = client.command.b.run()
+                self.assertEqual(client.sent, [])
+                raise ValueError
+        self.assertEqual(batch.commands, [first, second])
+        self.assertEqual(inner.commands, [second])
+        self.assertEqual(client.sent, [[9, -1, 2, [
+            [0, first._ccid, 'a', {'args': (1,), 'kwargs': {'x': 2}}],
+            [2, second._ccid, 'b', {'args': (), 'kwargs': {}}],
+        ]]])
+        # Not in a batch anymore
+        client.command.c()
+        self.assertEqual(client.sent[-1][0], 0)
+
+    def test_timeout(self):
+        "command: Response not in time -> `CommandTimeoutError`, cancel sent, late response dropped"
+
+        client = DummyClient()
+        client.command._default_timeout = 0.01
+        call = client.command.slow(1)
+        with self.assertRaises(exceptions.CommandTimeoutError):
+            call.result
+        self.assertEqual(client.sent[-1][:2], [3, call._ccid])
+        self.assertEqual(client.command._unresolved, {})
+        client.respond(call._ccid, 'late')
+        self.assertEqual(client.command._cancelled, set())
+        with self.assertRaises(exceptions.CommandTimeoutError):
+            call.result
+        fast = client.command.fast.with_timeout(None)(2)
+        client.respond(fast._ccid, 'ok')
+        self.assertEqual(fast.result, 'ok')
+
+        async def awaited():
+            return await client.command.slow.with_timeout(0.01)(3)
+        with self.assertRaises(exceptions.CommandTimeoutError):
+            asyncio.run(awaited())
+        self.assertEqual(client.command._unresolved, {})
+
+    def test_await(self):
+        "command: Call awaited in a coroutine, resolved in another thread -> Coroutine resumed with the result"
+
+        client = DummyClient()
+        call = client.command.slow(1)
+        threading.Timer(0.01, client.respond, args=(call._ccid, 'ok')).start()
+
+        async def awaited():
+            return await call
+        self.assertEqual(asyncio.run(awaited()), 'ok')
+        # An already resolved call is awaited at once
+        self.assertEqual(asyncio.run(awaited()), 'ok')
+
+        late = client.command.slow.with_timeout(0.01)(2)
+        threading.Timer(0.2, client.respond, args=(late._ccid, 'late')).start()
+        async def timed_out():
+            return await late
+        with self.assertRaises(exceptions.CommandTimeoutError):
+            asyncio.run(timed_out())
+        self.assertEqual(client.sent[-1][:2], [3, late._ccid])
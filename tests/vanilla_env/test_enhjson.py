@@ -1,5 +1,7 @@
 """Test suite for the `_enhjson.py` module
 """
+import array
+import json
 import unittest
 from mupf import _enhjson as j
 
@@ -115,6 +117,25 @@ class EnhJSON(unittest.TestCase):
         c = j.encode(j.EnhancedBlock([7, "a", [3,5,6]], opt=j.OptPolicy.none), escape=escape)
         self.assertEqual(c, '[7,"a",[3,5,6]]')
 
+    def test_addresses_opt_policy(self):
+        "enhjson: Input with `OptPolicy.addresses` -> Addresses of escapes encoded, only those decoded"
+
+        value = {"args":[K(), "prop", {"k": [KK(), ["~a", 0]]}], "kwargs": {"big": list(range(10))}}
+        a = j.encode(j.EnhancedBlock(value, opt=j.OptPolicy.addresses), escape=escape)
+        self.assertEqual(a,
+            '["~",{"args":[["~@",650],"prop",{"k":[["~@",650,340],["~~",["~a",0]]]}],'
+            '"kwargs":{"big":[0,1,2,3,4,5,6,7,8,9]}},{"c":3,"a":[["args",0],["args",2,"k",0],["args",2,"k",1]]}]'
+        )
+        b = j.encode(j.EnhancedBlock([7, "a"], opt=j.OptPolicy.addresses), escape=escape)
+        self.assertEqual(b, '[7,"a"]')
+
+        encoded = json.loads(a)
+        big = encoded[1]["kwargs"]["big"]
+        decoders = {"@": lambda rid, ctxrid=None: f"obj{rid}"}
+        decoded = j.decode_enhblock(encoded, decoders)
+        self.assertEqual(decoded["args"], ["obj650", "prop", {"k": ["obj650", ["~a", 0]]}])
+        self.assertIs(decoded["kwargs"]["big"], big)
+
     def test_escape(self):
         "enhjson: Bad escape routine -> Encoded strings"
 
@@ -125,6 +146,153 @@ class EnhJSON(unittest.TestCase):
         c = j.encode(j.EnhancedBlock([1,2,1000,4,5]), escape=bad_escape)
         self.assertEqual(c, '["~",[1,2,["~?","IllformedEscTupleError","\'very long very long very long very long very long very long very long very long very long very long very long very long very lo"],4,5],{"c":1}]')
 
+    def test_string_escaping(self):
+        "enhjson: Strings with all kinds of characters -> Encoded strings identical to the `_string_esc` lookup table"
+
+        samples = [
+            "".join(map(chr, range(0x80))),
+            "\u00a0\u0105\u2028\u2029\uffff\U0001F600",
+            "a\\b\"c\td\x00e\x1ff\x7fg",
+            "",
+        ]
+        for sample in samples:
+            expected = b'"' + b''.join(j._string_esc[i] for i in sample.encode('utf-8')) + b'"'
+            self.assertEqual(j.encode(sample).encode('utf-8'), expected)
+            self.assertEqual(j.encode({sample: 0}).encode('utf-8'), b'{' + expected + b':0}')
+
+    def test_element_type_cache(self):
+        "enhjson: Values of builtin, custom and registered types -> Classification cached per type"
+
+        saved_table = j._element_type_by_type.copy()
+        def restore_table():
+            j._element_type_by_type.clear()
+            j._element_type_by_type.update(saved_table)
+        self.addCleanup(restore_table)
+
+        class Mapping:
+            def keys(self):
+                return ['a']
+            def __getitem__(self, key):
+                return 1
+
+        class Point:
+            def __init__(self, x, y):
+                self.x, self.y = x, y
+            def __len__(self):
+                return 2
+            def __getitem__(self, key):
+                return (self.x, self.y)[key]
+
+        self.assertEqual(j.test_element_type(True), j.JsonElement.Bool)
+        self.assertEqual(j.test_element_type(Mapping()), j.JsonElement.Object)
+        self.assertIs(j._element_type_by_type[Mapping], j.JsonElement.Object)
+        self.assertEqual(j.test_element_type(KK()), j.JsonElement.Autonomous)
+        self.assertEqual(j.test_element_type(j.undefined), j.JsonElement.Autonomous)
+        self.assertNotIn(type, j._element_type_by_type)
+        self.assertEqual(j.test_element_type(print), j.JsonElement.Unknown)
+        self.assertNotIn(type(print), j._element_type_by_type)
+        self.assertEqual(j.encode(Mapping()), '{"a":1}')
+        self.assertEqual(j.encode(Point(3, 4)), '[3,4]')
+        point = Point(3, 4)
+        j.register_element_type(Point, j.JsonElement.Unknown)
+        self.assertEqual(j.encode(j.EnhancedBlock(point)), f'["~",["~?","UnknownObjectError","{point!r}"],{{"c":1}}]')
+        with self.assertRaises(TypeError):
+            j.register_element_type(Point, 'Array')
+
+    def test_iterencode(self):
+        "enhjson: Long values encoded in chunks -> Chunks of fixed size, joined equal to `encode()`"
+        value = [{'id': i, 'name': f'item "{i}"', 'k': KK()} for i in range(200)]
+        whole = j.encode(j.EnhancedBlock(value))
+        chunks = list(j.iterencode(j.EnhancedBlock(value), chunk_size=100))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) == 100 for chunk in chunks[:-1]))
+        self.assertLessEqual(len(chunks[-1]), 100)
+        self.assertEqual(''.join(chunks), whole)
+        self.assertEqual(list(j.iterencode([1, 2], chunk_size=100)), ['[1,2]'])
+        # A block still open when a chunk is taken cannot be dropped anymore, so it is left explicit...
+        value = [j.EnhancedBlock(list(range(1000)))]
+        chunks = list(j.iterencode(value, chunk_size=10, fast_path=False))
+        self.assertEqual(json.loads(''.join(chunks)), [["~", list(range(1000)), {"c": 0}]])
+        # ... but with the fast path an escape-free value is encoded as a whole before it is chunked
+        chunks = list(j.iterencode(value, chunk_size=10))
+        self.assertEqual(''.join(chunks), j.encode(value))
+
+    def test_iterencode_length(self):
+        "enhjson: Header filled after the buffer is measured -> Length of the buffer kept up to date"
+        class Block:
+            def write_header(self, stream):
+                stream.release(self)
+                stream.fill(pos, '["~",')
+        block = Block()
+        output = j._Output()
+        pos = output.reserve(block)
+        for _ in range(300):
+            output.write('ab')
+        self.assertEqual(output.take_chunks(1000), ())
+        block.write_header(output)
+        self.assertEqual(output.take_chunks(1000), ())
+        self.assertEqual(output._length, 605)
+        output.write('c' * 400)
+        for _ in range(300):
+            output.write('')
+        self.assertEqual([len(chunk) for chunk in output.take_chunks(1000)], [1000])
+        self.assertEqual(output._length, 5)
+
+    def test_buffers(self):
+        "enhjson: bytes, bytearray, memoryview, array.array -> Base64 escapes `~B`, decoded as bytes"
+        value = [b'\x01\x02\x03', bytearray(b'ab'), memoryview(b'abcdef')[::2], array.array('d', [1.5])]
+        self.assertEqual(
+            j.encode(j.EnhancedBlock(value)),
+            '["~",[["~B","AQID"],["~B","YWI="],["~B","YWNl"],["~B","AAAAAAAA+D8=","Float64Array"]],{"c":4}]'
+        )
+        decoded = j.decode(json.loads(j.encode(j.EnhancedBlock(value))), {"B": j.decode_buffer})
+        self.assertEqual(decoded, [b'\x01\x02\x03', b'ab', b'ace', array.array('d', [1.5]).tobytes()])
+        self.assertEqual(j.encode([1, b'ab', bytearray(b'c'), array.array('h', [-1, 2])]), '[1,[97,98],[99],[-1,2]]')
+
+    def test_fast_path(self):
+        "enhjson: Inputs with and without escapes -> Fast path output identical to the stack machine"
+
+        values = [
+            [0, 12, '*set*', {"args": ['a"\\\x0b\x1f ż', 1e300, -0.0, 10**20, (1, True, None)], "kwargs": {}}],
+            {"~k": [["x", "~y"]], 2: "b"},
+            [["~x", 1], 2],
+            [1, j.EnhancedBlock(float('nan'))],
+            {"k": b'ab', "m": KK()},
+            (1, 2, (1, 2, {3: 4})),
+            {True: 1, "a": {None: [False]}, 2.5: "\\u001a\x1a\\\x1f"},
+            {"true": 1},
+        ]
+        for value in values:
+            fast = j.encode(j.EnhancedBlock(value), fast_path=True)
+            slow = j.encode(j.EnhancedBlock(value), fast_path=False)
+            self.assertEqual(fast, slow)
+            self.assertEqual(j.encode(value), j.encode(value, fast_path=False))
+        self.assertIsNotNone(j._fast_encode(j.EnhancedBlock(values[0])))
+        self.assertIsNone(j._fast_encode(j.EnhancedBlock(values[0], explicit=True)))
+        self.assertIsNone(j._fast_encode(j.EnhancedBlock(values[2])))
+        self.assertIsNone(j._fast_encode(values[4]))
+        self.assertIsNone(j._fast_encode(values[6]))
+        self.assertEqual(j._fast_encode({"k": "\\u001a\x1a"}), '{"k":"\\\\u001a\\u001A"}')
+
+    def test_back_references(self):
+        "enhjson: Shared and cyclic objects in a block with `refs` -> Back-references, decoded as the same objects"
+
+        style = {"color": "red"}
+        cycle = [1]
+        cycle.append(cycle)
+        value = {"nodes": [{"s": style}, {"s": style}], "k": style, "cycle": cycle}
+        a = j.encode(j.EnhancedBlock(value, refs=True))
+        self.assertEqual(a,
+            '["~",{"nodes":[{"s":{"color":"red"}},{"s":["~^",["nodes",0,"s"]]}],"k":["~^",["nodes",0,"s"]],'
+            '"cycle":[1,["~^",["cycle"]]]},{"c":3,"r":[["nodes",1,"s"],["k"],["cycle",1]]}]'
+        )
+        for opt in j.OptPolicy:
+            decoded = j.decode_enhblock(json.loads(j.encode(j.EnhancedBlock(value, opt=opt, refs=True))), {})
+            self.assertIs(decoded["nodes"][1]["s"], decoded["nodes"][0]["s"])
+            self.assertIs(decoded["k"], decoded["nodes"][0]["s"])
+            self.assertIs(decoded["cycle"][1], decoded["cycle"])
+        self.assertEqual(j.encode(j.EnhancedBlock([style, style])), '[{"color":"red"},{"color":"red"}]')
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
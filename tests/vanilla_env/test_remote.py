@@ -1,9 +1,11 @@
 """Test suite for the `_remote.py` module
 """
 
+import asyncio
+import threading
 import unittest
 
-from mupf import _symbols as S
+from mupf import _command, _srvthr, _symbols as S
 import mupf
 
 class RemoteObj(unittest.TestCase):
@@ -31,6 +33,81 @@ class RemoteObj(unittest.TestCase):
         self.assertEqual(S.rid.weakref, False)
 
 
+class RemoteObjRegistry(unittest.TestCase):
+
+    def setUp(self) -> None:
+        print(self.shortDescription())
+
+    def test_decoding_in_many_threads(self):
+        "remote: Message parsed once, decoded in many threads -> Decoded once, one `RemoteObj` for each rid"
+
+        app = mupf.App()
+        app._event_loop = asyncio.new_event_loop()
+        app._event_loops = [app._event_loop]
+        self.addCleanup(app._event_loop.close)
+        client = mupf.client.Client(app, app.get_unique_client_id())
+        client.features.add(+mupf.F.core_features)
+        # The released `RemoteObj`s send `*gc*` through the app
+        self.addCleanup(lambda: app)
+        msg = _srvthr.ParsedMessage([1, 4, 0, ['~', {'result': ['~@', 7, None]}, {'c': 1}]])
+        barrier = threading.Barrier(8)
+        decoded = []
+        objs = []
+
+        def decode():
+            barrier.wait()
+            decoded.append(client._decode_crrcan_msg(msg))
+            objs.append(client.get_remote_obj(8))
+
+        threads = [threading.Thread(target=decode) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(d is decoded[0] for d in decoded))
+        self.assertIs(decoded[0][3]['result'], client.get_remote_obj(7))
+        self.assertTrue(all(obj is objs[0] for obj in objs))
+        self.assertEqual(msg[3], ['~', {'result': ['~@', 7, None]}, {'c': 1}])
+
+
+class AsyncRemoteObj(unittest.TestCase):
+
+    def setUp(self) -> None:
+        print(self.shortDescription())
+
+    def test_aio(self):
+        "remote: `obj[S.aio]` syntax -> Commands returned, not waited for, awaitable in a coroutine"
+
+        class Client:
+            """ Records the sent messages, and resolves all commands at once with their ccids """
+            _healthy_connection = False
+            def __init__(self):
+                self._cid = 'dummy0abcdefghABCDEFGH'
+                self.sent = []
+                self.command = _command.create_command_class_for_client(self)
+            def _send(self, data):
+                self.sent.append(data)
+                threading.Thread(
+                    target=self.command.set_resolved_mupf, args=(data[1], [1, data[1], 0, {'result': data[1]}])
+                ).start()
+            def _decode_crrcan_msg(self, msg):
+                return msg
+
+        client = Client()
+        obj = mupf._remote.RemoteObj(5, client)
+        aio = obj[S.aio]
+        self.assertIsInstance(aio, mupf._remote.AsyncRemoteObj)
+        calls = [aio.innerHTML, aio['x'], aio(1, 2), aio.set('y', 3)]
+        self.assertTrue(all(isinstance(call, _command.CommandCall) for call in calls))
+        self.assertEqual([msg[2] for msg in client.sent], ['*get*', '*get*', '*call*', '*set*'])
+        self.assertEqual(client.sent[2][3], {'args': (1, 2), 'kwargs': {'id': 5, 'this_': None}})
+
+        async def awaited():
+            return await obj[S.aio].outerHTML
+        result = asyncio.run(awaited())
+        self.assertEqual(result, client.sent[-1][1])
+
+
 # import mupf
 # from mupf._remote import RemoteObj
 
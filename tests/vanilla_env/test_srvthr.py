@@ -0,0 +1,258 @@
+"""Test suite for the `_srvthr.py` module
+"""
+
+import asyncio
+import queue
+import threading
+import time
+import types
+import unittest
+
+from mupf import _srvthr, exceptions
+
+class CrrcanFraming(unittest.TestCase):
+
+    def setUp(self) -> None:
+        print(self.shortDescription())
+
+    def test_binary_header(self):
+        "srvthr: Binary CRRCAN headers with `int` and `str` nouns -> Unpacked equal to packed"
+
+        for mode, ccid, noun in ((0, 3, '*install*'), (1, 12, 0), (7, -1, '*close*'), (5, 2**31-1, -5), (2, 4, 'żółw')):
+            data = _srvthr.pack_crrcan_header(mode, ccid, noun) + b'{"args":[]}'
+            *header, payload_start = _srvthr.unpack_crrcan_header(data)
+            self.assertEqual(header, [mode, ccid, noun])
+            self.assertEqual(data[payload_start:], b'{"args":[]}')
+
+        self.assertEqual(_srvthr.pack_crrcan_header(1, 2, 0), b'\x01\x02\x00\x00\x00\x00\x00\x00\x00\x00')
+        with self.assertRaises(_srvthr.BadCRRCANMessageError):
+            _srvthr.unpack_crrcan_header(b'\x01\x02\x00\x00\x00\x07\x00\x00\x00\x00')
+
+    def test_bundles(self):
+        "srvthr: Batch of text, binary and fragmented messages -> Text messages bundled in order"
+
+        self.assertEqual(_srvthr.bundle_crrcan_messages(['[2,1,"a",{}]'], 1000), ['[2,1,"a",{}]'])
+        self.assertEqual(
+            _srvthr.bundle_crrcan_messages(['[2,1,"a",{}]', '[0,2,"b",{}]', b'\x02', '[2,3,"c",{}]', ['[2,4,', '"d",{}]']], 1000),
+            ['[8,-1,2,[[2,1,"a",{}],[0,2,"b",{}]]]', b'\x02', '[2,3,"c",{}]', ['[2,4,', '"d",{}]']],
+        )
+        self.assertEqual(
+            _srvthr.bundle_crrcan_messages(['[2,1,"a",{}]', '[2,2,"b",{}]', '[2,3,"c",{}]'], 26),
+            ['[8,-1,2,[[2,1,"a",{}],[2,2,"b",{}]]]', '[2,3,"c",{}]'],
+        )
+
+    def test_chunks(self):
+        "srvthr: Long messages in interleaved chunks, text and binary -> Messages put together, short one not waiting"
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        app = types.SimpleNamespace(
+            _outqueue_limit=None, _outqueue_policy=None, _bundle=False, _flush_delay=0.0, _fragment_size=0,
+            _parse_once=False,
+        )
+        resolved = []
+
+        class Client(_srvthr.Client_SrvThrItf):
+            _healthy_connection = True
+            _app_wr = lambda self: app
+            _get_eventloop = lambda self: loop
+            command = types.SimpleNamespace(set_resolved_mupf=lambda ccid, data: resolved.append(data))
+
+        client = Client()
+        text = '[1,3,0,{"result":"żółw \\"x\\""}]'
+        binary = _srvthr.pack_crrcan_header(1, 4, 0) + '{"result":"żółw"}'.encode('utf-8')
+        text_chunks = _srvthr.chunk_crrcan_message([text[:5], text[5:20], text[20:]], 1)
+        binary_chunks = _srvthr.chunk_crrcan_message([binary[:7], binary[7:]], 2)
+        self.assertEqual(type(text_chunks), _srvthr.ChunkedMessage)
+        self.assertEqual(text_chunks[0], '[4,1,1,"[1,3,"]')
+        for data in (text_chunks[0], binary_chunks[0], text_chunks[1], binary_chunks[1], text_chunks[2]):
+            client._Client_SrvThrItf__crrcan_switchboard(data, 'test')
+        self.assertEqual(resolved, [binary, text])
+
+        class WebSocket:
+            sent = []
+            async def send(self, data):
+                self.sent.append(data)
+
+        expected = ['[2,5,"short",{}]', *text_chunks]
+        client._send(text_chunks)
+        client._send('[2,5,"short",{}]')
+        writer = client._Client_SrvThrItf__writer(WebSocket())
+        with self.assertRaises(asyncio.TimeoutError):
+            loop.run_until_complete(asyncio.wait_for(writer, 0.05))
+        self.assertEqual(WebSocket.sent, expected)
+
+    def test_chunk_stream(self):
+        "srvthr: Long message encoded while sent -> Few chunks held at a time, abandoned if the encoding fails"
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        app = types.SimpleNamespace(
+            _outqueue_limit=None, _outqueue_policy=None, _bundle=False, _flush_delay=0.0, _fragment_size=0,
+            _parse_once=False,
+        )
+
+        class Client(_srvthr.Client_SrvThrItf):
+            _healthy_connection = True
+            _app_wr = lambda self: app
+            _get_eventloop = lambda self: loop
+
+        class WebSocket:
+            sent = []
+            async def send(self, data):
+                self.sent.append(data)
+
+        client = Client()
+        encoded = []
+        def pieces():
+            for n in range(10):
+                encoded.append(n)
+                yield str(n)
+        sender = threading.Thread(target=client._send_chunked, args=(pieces(),), kwargs={'bounded': True}, daemon=True)
+        sender.start()
+        time.sleep(0.05)
+        self.assertTrue(sender.is_alive())
+        (stream, _), = client._outqueue
+        self.assertEqual(len(stream), _srvthr._CHUNK_STREAM_DEPTH)
+        # The chunk waiting for the room, and the next piece looked ahead
+        self.assertEqual(len(encoded), _srvthr._CHUNK_STREAM_DEPTH + 2)
+        writer = client._Client_SrvThrItf__writer(WebSocket())
+        with self.assertRaises(asyncio.TimeoutError):
+            loop.run_until_complete(asyncio.wait_for(writer, 0.1))
+        sender.join()
+        self.assertEqual(WebSocket.sent, [f'[4,1,{int(n < 9)},"{n}"]' for n in range(10)])
+
+        def failing():
+            yield 'a'
+            yield 'b'
+            raise ValueError()
+        with self.assertRaises(ValueError):
+            client._send_chunked(failing())
+        (stream, _), = client._outqueue
+        self.assertEqual(list(stream), ['[4,2,1,"a"]', '[4,2,-1,""]'])
+        self.assertTrue(stream.done)
+        resolved = []
+        client.command = types.SimpleNamespace(set_resolved_mupf=lambda ccid, data: resolved.append(data))
+        for data in ('[4,5,1,"[1,3,"]', '[4,5,-1,""]', '[4,5,0,"[1,4,0,{}]"]'):
+            client._Client_SrvThrItf__crrcan_switchboard(data, 'test')
+        self.assertEqual(resolved, ['[1,4,0,{}]'])
+
+    def test_parse_once(self):
+        "srvthr: Messages parsed in the server thread -> Passed as `ParsedMessage`, bundles not parsed again"
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        app = types.SimpleNamespace(_outqueue_limit=None, _outqueue_policy=None)
+        resolved = []
+
+        class Client(_srvthr.Client_SrvThrItf):
+            _healthy_connection = True
+            _app_wr = lambda self: app
+            _get_eventloop = lambda self: loop
+            _callback_queue = queue.SimpleQueue()
+            command = types.SimpleNamespace(set_resolved_mupf=lambda ccid, data: resolved.append(data))
+
+        client = Client()
+        client._Client_SrvThrItf__parse_once = True
+        for data in (
+            '[1,3,0,{"result":"a"}]',
+            '[8,-1,2,[[1,4,0,{"result":["~",[["~@",5,null]],{"c":1}]}],[7,-1,"*close*",{}]]]',
+            '[1,5,0,{"result":',
+        ):
+            client._Client_SrvThrItf__crrcan_switchboard(data, 'test')
+        self.assertEqual([type(data) for data in resolved], [_srvthr.ParsedMessage, _srvthr.ParsedMessage, str])
+        self.assertEqual(resolved[1], [1, 4, 0, {'result': ['~', [['~@', 5, None]], {'c': 1}]}])
+        task = client._callback_queue.get_nowait()
+        self.assertEqual((task._noun, type(task._raw_data)), ('*close*', _srvthr.ParsedMessage))
+        with self.assertRaises(_srvthr.BadCRRCANMessageError):
+            client._Client_SrvThrItf__crrcan_switchboard('[8,-1,1,[[1,6,0]]]', 'test')
+
+
+class Outqueue(unittest.TestCase):
+
+    def setUp(self) -> None:
+        print(self.shortDescription())
+
+    def make_client(self, limit, policy):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        app = types.SimpleNamespace(_outqueue_limit=limit, _outqueue_policy=policy)
+
+        class Client(_srvthr.Client_SrvThrItf):
+            _healthy_connection = True
+            _app_wr = lambda self: app
+            _get_eventloop = lambda self: loop
+
+        return Client()
+
+    def test_full_outqueue_policies(self):
+        "srvthr: Messages sent to a full outqueue -> Error raised, or the oldest notifications dropped"
+
+        client = self.make_client(3, _srvthr.OutqueuePolicy.error)
+        for n in range(3):
+            client._send(str(n))
+        with self.assertRaises(exceptions.OutqueueFullError):
+            client._send('3')
+        self.assertEqual([data for data, _ in client._outqueue], ['0', '1', '2'])
+
+        client = self.make_client(3, _srvthr.OutqueuePolicy.drop_notifications)
+        client._send('cmd0')
+        client._send('ntf1', notification=True)
+        client._send('ntf2', notification=True)
+        client._send('cmd3')
+        client._send('ntf4', notification=True)
+        self.assertEqual([data for data, _ in client._outqueue], ['cmd0', 'cmd3', 'ntf4'])
+        self.assertEqual(
+            client._get_outqueue_stats(),
+            {'depth': 3, 'peak_depth': 3, 'queued': 5, 'dropped': 2, 'blocked': 0},
+        )
+
+    def test_full_outqueue_blocking(self):
+        "srvthr: Full outqueue, long messages being sent, event loop thread -> Long ones counted, loop never blocked"
+
+        client = self.make_client(2, _srvthr.OutqueuePolicy.error)
+        client._Client_SrvThrItf__init_srvthr()
+        client._send(_srvthr.chunk_crrcan_message(['[1,', '2]'], 1))
+        loop = client._get_eventloop()
+        self.assertEqual(len(loop.run_until_complete(client._Client_SrvThrItf__consume_outqueue())), 1)
+        client._send('0')
+        with self.assertRaises(exceptions.OutqueueFullError):
+            client._send('1')
+
+        client = self.make_client(2, _srvthr.OutqueuePolicy.block)
+        client._send('0')
+        client._send('1')
+        async def send_in_loop():
+            client._send('2')
+        client._get_eventloop().run_until_complete(send_in_loop())
+        self.assertEqual([data for data, _ in client._outqueue], ['0', '1', '2'])
+        self.assertEqual(client._get_outqueue_stats()['blocked'], 0)
+
+    def test_single_wakeup(self):
+        "srvthr: Many messages sent between two event loop iterations -> One wake-up, messages in order"
+
+        class CountingLoop(asyncio.SelectorEventLoop):
+            wakeups = 0
+            def call_soon_threadsafe(self, callback, *args, **kwargs):
+                self.wakeups += 1
+                return super().call_soon_threadsafe(callback, *args, **kwargs)
+
+        loop = CountingLoop()
+        self.addCleanup(loop.close)
+        app = types.SimpleNamespace(
+            _outqueue_limit=None, _outqueue_policy=None, _bundle=False, _flush_delay=0.0, _fragment_size=0,
+        )
+
+        class Client(_srvthr.Client_SrvThrItf):
+            _healthy_connection = True
+            _app_wr = lambda self: app
+            _get_eventloop = lambda self: loop
+
+        client = Client()
+        for n in range(100):
+            client._send(str(n))
+        self.assertEqual(loop.wakeups, 2)   # the first one is the `__init_srvthr`
+        sent = loop.run_until_complete(client._Client_SrvThrItf__consume_outqueue())
+        self.assertEqual(sent, [str(n) for n in range(100)])
+        client._send('100')
+        self.assertEqual(loop.wakeups, 3)